@@ -0,0 +1,115 @@
+# counts, across a corpus of XML records, the thesauri they cite and the vocabularies their anchor keywords
+# link to, and reports which of them the KB lacks, so that missing vocabularies can be loaded and caches warmed
+# before a big run. Thesauri and keywords are found by the same rules extract.py uses
+#
+#   python census.py RECORDS_DIR [OUTPUT_CSV]
+
+import csv
+import sys
+from collections import Counter
+from multiprocessing import Pool
+from pathlib import Path
+
+from lxml import etree
+from prettytable import PrettyTable
+
+from utils import get_metadata_profile, send_query_to_db, QueryError
+from extract import get_profile_prefixes, get_thesaurus_iri_and_name, get_kws_per_thes, match_thes_to_kb
+
+CHUNK_SIZE = 50
+
+
+def vocabulary_prefix(iri: str) -> str:
+    return iri.strip().rstrip("/").rsplit("/", 1)[0] + "/"
+
+
+def census_record(record: Path) -> (Counter, Counter, dict):
+    thesauri = Counter()
+    prefixes = Counter()
+    samples = {}
+    try:
+        et = etree.parse(str(record))
+    except etree.XMLSyntaxError:
+        return thesauri, prefixes, samples
+
+    prefix, prefix_2, namespaces = get_profile_prefixes(get_metadata_profile(et))
+
+    for keyword_set in et.xpath(f"//{prefix}:MD_Keywords", namespaces=namespaces):
+        for thesaurus in keyword_set.xpath(f"{prefix}:thesaurusName", namespaces=namespaces):
+            iri, name = get_thesaurus_iri_and_name(thesaurus, namespaces, prefix_2)
+            thesauri[(iri.strip() if iri else None, name.strip() if name else None)] += 1
+
+        for kw in get_kws_per_thes(keyword_set, prefix, prefix_2, namespaces):
+            if kw["value"].startswith("http"):
+                p = vocabulary_prefix(kw["value"])
+                prefixes[p] += 1
+                samples.setdefault(p, kw["value"].strip())
+
+    return thesauri, prefixes, samples
+
+
+def census(records: list, processes: int = None) -> (Counter, Counter, dict):
+    thesauri = Counter()
+    prefixes = Counter()
+    samples = {}
+    with Pool(processes) as pool:
+        for t, p, s in pool.imap_unordered(census_record, records, chunksize=CHUNK_SIZE):
+            thesauri.update(t)
+            prefixes.update(p)
+            for k, v in s.items():
+                samples.setdefault(k, v)
+
+    return thesauri, prefixes, samples
+
+
+def thesaurus_in_kb(iri: str, name: str):
+    # True or False, or None if it can't be checked
+    if iri is None and name is None:
+        return None
+    try:
+        if match_thes_to_kb(iri, name)[0] is not None:
+            return True
+        # a thesaurus known only by its title is in the KB only if the system graph names it
+        if iri is None:
+            return False
+        return send_query_to_db("ASK { GRAPH <XXX> { ?c a <http://www.w3.org/2004/02/skos/core#Concept> } }".replace("XXX", iri))
+    except QueryError:
+        return None
+
+
+def concept_in_kb(iri: str):
+    try:
+        return send_query_to_db("ASK { <XXX> a <http://www.w3.org/2004/02/skos/core#Concept> }".replace("XXX", iri))
+    except QueryError:
+        return None
+
+
+if __name__ == "__main__":
+    records = sorted(Path(sys.argv[1]).glob("*.xml"))
+    output_file = Path(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    thesauri, prefixes, samples = census(records)
+
+    rows = []
+    for (iri, name), n in thesauri.most_common():
+        rows.append(["thesaurus", iri, name, n, thesaurus_in_kb(iri, name)])
+    for p, n in prefixes.most_common():
+        rows.append(["anchor prefix", p, samples[p], n, concept_in_kb(samples[p])])
+
+    table = PrettyTable()
+    table.field_names = ["Kind", "IRI", "Name / Sample", "Count", "In KB"]
+    table.align = "l"
+    for row in rows:
+        table.add_row(row)
+    print(table)
+
+    missing = [row for row in rows if row[4] is False]
+    print(f"{len(records)} records, {len(thesauri)} thesauri, {len(prefixes)} anchor prefixes, {len(missing)} missing from the KB")
+    for row in missing:
+        print(f"missing {row[0]}: {row[1]}")
+
+    if output_file is not None:
+        with open(output_file, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["kind", "iri", "name_or_sample", "count", "in_kb"])
+            writer.writerows(rows)
@@ -0,0 +1,171 @@
+# processes a whole corpus of XML records in three phases, rather than record by record:
+#   1. extract the thesauri & keywords of every record and spill them to disk
+#   2. resolve each unique (thesaurus, keyword) pair once, working through one thesaurus at a time
+#   3. join the resolved keywords back to each record and write the results
+# so the matching cost depends on the number of unique keywords in the corpus, not keyword occurrences
+
+import gzip
+import json
+from pathlib import Path
+from time import perf_counter
+from typing import List
+
+from lxml import etree
+
+from utils import QueryError, query_cache_prep, query_cache_store
+import extract
+from extract import get_thes_and_kws, match_kw_to_kb_with_tier, convert_results_to_graph, cache_prep, cache_store, \
+    quarantine_add, RecordError, KW_CACHE, cache_add_entry, verify_concept_iris, is_well_known_iri
+from kb_index import kb_index_open, KB_INDEX_FILE
+from tabular import MatchResultsWriter
+
+
+def spill_keywords(records: List[Path], spill_file: Path, quarantine_file: Path) -> int:
+    # one JSON line per record, holding its thesauri, as found by get_thes_and_kws, in a list as keys may be None
+    count = 0
+    with gzip.open(spill_file, "wt", encoding="utf-8") as f:
+        for record in records:
+            try:
+                doc_iri, theses = get_thes_and_kws(etree.parse(record))
+            except Exception as e:
+                print(f"quarantined: {e}")
+                quarantine_add(quarantine_file, record, e)
+                continue
+
+            f.write(json.dumps({
+                "record": str(record),
+                "doc_iri": str(doc_iri),
+                "theses": [[thes, content["name"], content["keywords"]] for thes, content in theses.items()]
+            }) + "\n")
+            count += 1
+
+    return count
+
+
+def read_spill(spill_file: Path):
+    with gzip.open(spill_file, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def thesaurus_key(thes):
+    return None if thes in ("empty", None) else thes
+
+
+def resolve_unique_keywords(spill_file: Path, quiet: bool = False) -> (dict, dict):
+    unique = {}
+    occurrences = 0
+    for entry in read_spill(spill_file):
+        for thes, name, kws in entry["theses"]:
+            for kw in kws:
+                unique.setdefault(thesaurus_key(thes), set()).add(kw["value"])
+                occurrences += 1
+
+    print(f"{occurrences} keyword occurrences, {sum(len(v) for v in unique.values())} unique, {len(unique)} thesauri")
+
+    resolved = {}
+    errors = {}
+    # keywords without a thesaurus last, as they need the most expensive, full-text, queries
+    for thes in sorted(unique.keys(), key=lambda t: (t is None, t or "")):
+        if not quiet:
+            print(f"resolving {len(unique[thes])} keywords for {thes}")
+        iris = {kw for kw in unique[thes] if kw.startswith("http") and not is_well_known_iri(kw)}
+        try:
+            iri_graphs = verify_concept_iris(iris) if len(iris) > 0 else None
+        except QueryError:
+            iri_graphs = None
+
+        for kw_text in sorted(unique[thes]):
+            kw_iri = kw_text if kw_text.startswith("http") else None
+            try:
+                val, tier = match_kw_to_kb_with_tier(kw_text, kw_iri, thes, iri_graphs)
+            except QueryError as e:
+                errors[(kw_text, thes)] = {"keyword": kw_text, "thesaurus": thes, "error": str(e), "query": e.query}
+                continue
+
+            resolved[(kw_text, thes)] = (val, tier)
+            cache_add_entry(kw_text, thes, val, tier)
+
+    return resolved, errors
+
+
+def write_corpus_results(spill_file: Path, resolved: dict, errors: dict, resulting_nt_file: Path,
+                         results_writer: MatchResultsWriter, quarantine_file: Path) -> (int, int):
+    count = 0
+    failed = 0
+    with open(resulting_nt_file, "a") as f:
+        for entry in read_spill(spill_file):
+            thesauri = {}
+            record_errors = []
+            for thes, name, kws in entry["theses"]:
+                thesaurus = thesaurus_key(thes)
+                improved_kws = []
+                for kw in kws:
+                    if (kw["value"], thesaurus) in errors:
+                        record_errors.append(errors[(kw["value"], thesaurus)])
+                        continue
+                    val, tier = resolved[(kw["value"], thesaurus)]
+                    improved_kws.append({
+                        "value": val,
+                        "theme": kw["theme"],
+                        "thesaurus": thesaurus,
+                        "original": kw["value"],
+                        "tier": tier
+                    })
+                thesauri[thes] = {"name": name, "keywords": improved_kws}
+
+            if len(record_errors) > 0:
+                quarantine_add(quarantine_file, Path(entry["record"]), RecordError(entry["doc_iri"], record_errors))
+                failed += 1
+                continue
+
+            try:
+                nt = convert_results_to_graph(thesauri, entry["doc_iri"]).serialize(format="nt")
+            except Exception as e:
+                quarantine_add(quarantine_file, Path(entry["record"]), e)
+                failed += 1
+                continue
+
+            results_writer.add(entry["doc_iri"], thesauri)
+            f.write(nt)
+            f.write("\n\n")
+            count += 1
+
+    return count, failed
+
+
+if __name__ == "__main__":
+    kw_cache_file = "KW_CACHE.p"
+    query_cache_file = "QUERY_CACHE.p"
+    warm_files = []
+
+    cache_prep(kw_cache_file, KW_CACHE, warm_files)
+    query_cache_prep(query_cache_file)
+    extract.KB_INDEX = kb_index_open(KB_INDEX_FILE)
+
+    t1_start = perf_counter()
+
+    folder = "capital"
+    resulting_nt_file = Path(__file__).parent / f"{folder}-keywords.nt"
+    quarantine_file = Path(__file__).parent / f"{folder}-quarantine.jsonl"
+    results_file = Path(__file__).parent / f"{folder}-matches.csv"
+    spill_file = Path(__file__).parent / f"{folder}-keywords-spill.jsonl.gz"
+    quiet = False
+    records = sorted(Path(f"/home/nick/work/bodc/sa-records/{folder}").glob("*.xml"))
+
+    n = spill_keywords(records, spill_file, quarantine_file)
+    print(f"phase 1: extracted keywords from {n} records in {perf_counter() - t1_start:.1f}s")
+
+    resolved, errors = resolve_unique_keywords(spill_file, quiet)
+    print(f"phase 2: resolved {len(resolved)} keywords, {len(errors)} failed, in {perf_counter() - t1_start:.1f}s")
+
+    results_writer = MatchResultsWriter(results_file)
+    count, failed = write_corpus_results(spill_file, resolved, errors, resulting_nt_file, results_writer, quarantine_file)
+    results_writer.close()
+    print(f"phase 3: wrote {count} records, quarantined {failed}, in {perf_counter() - t1_start:.1f}s")
+
+    cache_store(kw_cache_file, KW_CACHE)
+    query_cache_store(query_cache_file)
+
+    t1_stop = perf_counter()
+    print("Elapsed time :", t1_stop - t1_start)
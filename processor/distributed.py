@@ -0,0 +1,171 @@
+# shares the processing of a harvest between workers on several hosts via a work queue (see workqueue.py)
+#
+#   python distributed.py populate QUEUE_FILE RECORDS_DIR   - queue up all the records in RECORDS_DIR
+#   python distributed.py work QUEUE_FILE [WORKER_ID]       - claim and process batches until the queue is empty
+#   python distributed.py status QUEUE_FILE
+#   python distributed.py merge QUEUE_FILE                  - merge the workers' output, quarantine & cache shards
+#
+# each worker writes its own shards, named after its WORKER_ID, next to the queue file. Records in a batch
+# that was re-claimed after its lease expired may appear in two shards, which the merge deduplicates: triples
+# by merge_nt_files, match results on (record, original, thesaurus) and quarantine entries on record
+
+import csv
+import json
+import os
+import pickle
+import socket
+import sys
+import threading
+from pathlib import Path
+
+from utils import query_cache_prep, query_cache_store, get_kb_version, pickle_store
+import extract
+from extract import process_records, cache_prep, cache_store, KW_CACHE
+from merge import merge_nt_files
+from kb_index import kb_index_open, KB_INDEX_FILE
+from tabular import MatchResultsWriter
+from workqueue import queue_connect, queue_populate, queue_claim, queue_renew, queue_complete, queue_status, \
+    queue_failed, LEASE_SECONDS
+
+KW_CACHE_FILE = "KW_CACHE.p"
+QUERY_CACHE_FILE = "QUERY_CACHE.p"
+
+
+def renew_lease(queue_file: Path, worker: str, batch: int, done: threading.Event):
+    # sqlite connections can't be shared between threads, so the renewer has its own
+    conn = queue_connect(queue_file)
+    while not done.wait(LEASE_SECONDS / 3):
+        if not queue_renew(conn, worker, batch):
+            print(f"lost the lease on batch {batch}")
+            break
+    conn.close()
+
+
+def work(queue_file: Path, worker: str):
+    shard_dir = queue_file.parent
+    kw_cache_file = shard_dir / f"KW_CACHE.{worker}.p"
+    query_cache_file = shard_dir / f"QUERY_CACHE.{worker}.p"
+
+    # start from the merged caches of previous runs, if there are any, and this worker's own, but only ever write
+    # the worker's own, as the merged caches are shared with the other workers
+    for shard in [shard_dir / KW_CACHE_FILE, kw_cache_file]:
+        if shard.is_file():
+            KW_CACHE.update(pickle.load(open(shard, "rb")))
+    cache_prep(kw_cache_file, KW_CACHE)
+    query_cache_prep(shard_dir / QUERY_CACHE_FILE)
+    extract.KB_INDEX = kb_index_open(shard_dir / KB_INDEX_FILE)
+
+    conn = queue_connect(queue_file)
+    results_writer = MatchResultsWriter(shard_dir / f"matches.{worker}.csv")
+    while True:
+        batch, records = queue_claim(conn, worker)
+        if batch is None:
+            break
+        print(f"{worker} claimed batch {batch} of {len(records)} records")
+
+        done = threading.Event()
+        renewer = threading.Thread(target=renew_lease, args=(queue_file, worker, batch, done), daemon=True)
+        renewer.start()
+        try:
+            count, failed = process_records(
+                records,
+                shard_dir / f"keywords.{worker}.nt",
+                shard_dir / f"quarantine.{worker}.jsonl",
+                results_writer,
+                quiet=True
+            )
+        finally:
+            done.set()
+            renewer.join()
+        queue_complete(conn, worker, batch)
+        print(f"{worker} completed batch {batch}: {count} records, {failed} quarantined")
+
+        # save the caches after every batch so a worker's progress survives it dying
+        cache_store(kw_cache_file, KW_CACHE)
+        query_cache_store(query_cache_file)
+
+    results_writer.close()
+    conn.close()
+
+
+def merge(queue_file: Path):
+    shard_dir = queue_file.parent
+
+    conn = queue_connect(queue_file)
+    status = queue_status(conn)
+    not_done = sum(n for s, n in status.items() if s not in ("done", "expired"))
+    if not_done > 0:
+        print(f"WARNING: {not_done} records are not done, so are missing from the merged output: {status}")
+        for path in queue_failed(conn):
+            print(f"failed: {path}")
+    conn.close()
+
+    stats = merge_nt_files(sorted(shard_dir.glob("keywords.*.nt")), shard_dir / "keywords.nt.gz")
+    print(f"triples: {stats['input_lines']} -> {stats['output_lines']}")
+
+    seen = set()
+    with open(shard_dir / "quarantine.jsonl", "w") as out:
+        for shard in sorted(shard_dir.glob("quarantine.*.jsonl")):
+            for line in open(shard):
+                if line.strip() == "":
+                    continue
+                record = json.loads(line)["record"]
+                if record not in seen:
+                    seen.add(record)
+                    out.write(line)
+    print(f"quarantined: {len(seen)}")
+
+    seen = set()
+    with open(shard_dir / "matches.csv", "w", newline="", encoding="utf-8") as out:
+        writer = None
+        for shard in sorted(shard_dir.glob("matches.*.csv")):
+            reader = csv.DictReader(open(shard, newline="", encoding="utf-8"))
+            if writer is None:
+                writer = csv.DictWriter(out, fieldnames=reader.fieldnames)
+                writer.writeheader()
+            for row in reader:
+                key = (row["record"], row["original"], row["thesaurus"])
+                if key not in seen:
+                    seen.add(key)
+                    writer.writerow(row)
+    print(f"matches: {len(seen)}")
+
+    kw_cache = set()
+    for shard in [shard_dir / KW_CACHE_FILE] + sorted(shard_dir.glob("KW_CACHE.*.p")):
+        if shard.is_file():
+            kw_cache.update(pickle.load(open(shard, "rb")))
+    cache_store(shard_dir / KW_CACHE_FILE, kw_cache)
+    print(f"KW_CACHE: {len(kw_cache)}")
+
+    kb_version = get_kb_version()
+    if kb_version is None:
+        print("QUERY_CACHE: the KB version is unknown, not merging")
+        return
+
+    responses = {}
+    for shard in [shard_dir / QUERY_CACHE_FILE] + sorted(shard_dir.glob("QUERY_CACHE.*.p")):
+        if shard.is_file():
+            stored = pickle.load(open(shard, "rb"))
+            # responses from other versions of the KB are stale
+            if stored.get("kb_version") == kb_version:
+                responses.update(stored["responses"])
+    pickle_store({"kb_version": kb_version, "responses": responses}, shard_dir / QUERY_CACHE_FILE)
+    print(f"QUERY_CACHE: {len(responses)}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1]
+    queue_file = Path(sys.argv[2])
+
+    if command == "populate":
+        n = queue_populate(queue_connect(queue_file), sorted(Path(sys.argv[3]).glob("*.xml")))
+        print(f"queued {n} records")
+    elif command == "work":
+        work(queue_file, sys.argv[3] if len(sys.argv) > 3 else f"{socket.gethostname()}-{os.getpid()}")
+    elif command == "status":
+        print(queue_status(queue_connect(queue_file)))
+    elif command == "merge":
+        merge(queue_file)
+    else:
+        print(f"unknown command {command}")
+        sys.exit(1)
@@ -1,9 +1,9 @@
-from enum import Enum
 from typing import Optional, Union, List
 from pathlib import Path
 
 from lxml import etree
-from utils import get_metadata_profile, make_record_iri, get_id, NAMESPACES, NAMESPACES_19139, NAMESPACES_19115_1, send_query_to_db, str_tidy, replace_all
+from utils import Profile, get_metadata_profile, make_record_iri, get_id, NAMESPACES, NAMESPACES_19139, NAMESPACES_19115_1, send_query_to_db, str_tidy, replace_all, \
+    query_cache_prep, query_cache_store, QueryError, pickle_store
 from hashlib import sha1
 
 from rdflib import Graph, BNode, Literal, URIRef
@@ -11,14 +11,30 @@ from rdflib.namespace import RDF, SDO
 
 from time import perf_counter
 
+import json
 import pickle
 
+from tabular import MatchResultsWriter, read_match_results
+from warm import read_kw_cache_entries
+from kb_index import kb_index_open, KB_INDEX_FILE, US
 
-class Profile(Enum):
-    SEADATANET = "SeaDataNet"
-    ISO19115 = "ISO19115"
-    ISO19139 = "ISO19139"
-    UNKNOWN = "Unknown"
+
+THES_CACHE = set()
+KW_CACHE = set()
+# (original, thesaurus) -> (value, tier) lookups over KW_CACHE
+KW_INDEX = {}
+# a memory-mapped index of the KB's exact-match lookups and concept IRIs, see kb_index.py, or None to query the KB
+# for them
+KB_INDEX = None
+# concept IRIs verified with one query each are sent in batches of this size
+VERIFY_BATCH_SIZE = 50
+
+
+class RecordError(Exception):
+    def __init__(self, doc_iri, errors):
+        super().__init__(f"{len(errors)} keyword(s) failed to match for {doc_iri}")
+        self.doc_iri = doc_iri
+        self.errors = errors
 
 
 def make_thesaurus_iri(name: str):
@@ -43,8 +59,9 @@ def get_kws_per_thes(kw_set: etree, prefix, prefix_2, namespaces) -> []:
             namespaces=namespaces,
         )
 
+        # ISO 19139 and ISO 19115-3 anchors
         anchor_keywords = md_keyword.xpath(
-            f"gmx:Anchor",
+            f"gmx:Anchor | gcx:Anchor",
             namespaces=namespaces)
 
         improved_anchor_keywords = []
@@ -74,22 +91,32 @@ def get_kws_per_thes(kw_set: etree, prefix, prefix_2, namespaces) -> []:
 
 
 def match_thes_to_kb(thes_iri: str, thes_name: str) -> {}:
+    # the index holds all of the exact matches these queries look for
+    if KB_INDEX is not None:
+        for kind, key in [("thes_alias", thes_iri), ("thes_pref", thes_name), ("thes_alt", thes_name)]:
+            r = KB_INDEX.get(kind, None, key) if key is not None else []
+            if len(r) > 0:
+                iri, name = r[0].split(US, 1)
+                return iri, name
+        return None, None
+
     # see if we have an aliasFor IRI for this thesaurus
-    q = """
-        PREFIX sa: <https://w3id.org/semanticanalyser/>
-        PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
-
-        SELECT ?iri ?name
-        WHERE {
-          GRAPH sa:system-graph {
-            ?iri sa:hasAlias <XXXX> ;
-                skos:prefLabel ?name .
-          }
-        }    
-        """.replace("XXXX", thes_iri)
-    r = send_query_to_db(q)
-    if len(r) > 0:
-        return r[0]["iri"]["value"], r[0]["name"]["value"]
+    if thes_iri is not None:
+        q = """
+            PREFIX sa: <https://w3id.org/semanticanalyser/>
+            PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+
+            SELECT ?iri ?name
+            WHERE {
+              GRAPH sa:system-graph {
+                ?iri sa:hasAlias <XXXX> ;
+                    skos:prefLabel ?name .
+              }
+            }    
+            """.replace("XXXX", thes_iri)
+        r = send_query_to_db(q)
+        if len(r) > 0:
+            return r[0]["iri"]["value"], r[0]["name"]["value"]
 
     if thes_name is not None:
         # if not, see if we can name match the thesaurus
@@ -153,20 +180,23 @@ def match_thes_to_kb(thes_iri: str, thes_name: str) -> {}:
     return None, None
 
 
-def match_thesaurus(thesaurus, namespaces, prefix_2):
+def get_thesaurus_iri_and_name(thesaurus, namespaces, prefix_2) -> (str, str):
+    # ISO 19115-3 citations' identifiers are in the mcc namespace, and their anchors in gcx
+    id_prefix, anchor = ("mcc", "gcx:Anchor") if prefix_2 == "cit" else (prefix_2, "gmx:Anchor")
+
     thesaurus_iris = thesaurus.xpath(f"@xlink:href", namespaces=namespaces)
     if len(thesaurus_iris) > 0:
         thesaurus_iri = thesaurus_iris[0]
     else:
         thesaurus_iris = thesaurus.xpath(
-            f"{prefix_2}:CI_Citation/{prefix_2}:identifier/{prefix_2}:MD_Identifier/{prefix_2}:code/gco:CharacterString/text()",
+            f"{prefix_2}:CI_Citation/{prefix_2}:identifier/{id_prefix}:MD_Identifier/{id_prefix}:code/gco:CharacterString/text()",
             namespaces=namespaces,
         )
         if len(thesaurus_iris) > 0:
             thesaurus_iri = thesaurus_iris[0]
         else:
             thesaurus_iris = thesaurus.xpath(
-                f"{prefix_2}:CI_Citation/{prefix_2}:identifier/{prefix_2}:MD_Identifier/{prefix_2}:code/gmx:Anchor/@xlink:href",
+                f"{prefix_2}:CI_Citation/{prefix_2}:identifier/{id_prefix}:MD_Identifier/{id_prefix}:code/{anchor}/@xlink:href",
                 namespaces=namespaces,
             )
             if len(thesaurus_iris) > 0:
@@ -174,13 +204,6 @@ def match_thesaurus(thesaurus, namespaces, prefix_2):
             else:
                 thesaurus_iri = None
 
-    # try and use thesaurus cache
-    # a, b = thes_cache_get(thesaurus_iri)
-    # if a is not None and b is not None:
-    #     return a, b
-
-    original_thesaurus_iri = thesaurus_iri
-
     thesaurus_names = thesaurus.xpath(f"@xlink:title", namespaces=namespaces)
     if len(thesaurus_names) > 0:
         thesaurus_name = thesaurus_names[0]
@@ -194,6 +217,19 @@ def match_thesaurus(thesaurus, namespaces, prefix_2):
         else:
             thesaurus_name = None
 
+    return thesaurus_iri, thesaurus_name
+
+
+def match_thesaurus(thesaurus, namespaces, prefix_2):
+    thesaurus_iri, thesaurus_name = get_thesaurus_iri_and_name(thesaurus, namespaces, prefix_2)
+
+    # try and use thesaurus cache
+    # a, b = thes_cache_get(thesaurus_iri)
+    # if a is not None and b is not None:
+    #     return a, b
+
+    original_thesaurus_iri = thesaurus_iri
+
     # if we have a thesaurus IRI, see if we have an aliasFor IRI for it
     if thesaurus_iri is not None:
         alias_iri, alias_name = match_thes_to_kb(thesaurus_iri, thesaurus_name)
@@ -214,15 +250,7 @@ def match_thesaurus(thesaurus, namespaces, prefix_2):
     return thesaurus_iri, improved_name
 
 
-def get_thes_and_kws(path_to_file_or_etree: Union[Path, etree], profile: Optional[Profile] = None, doc_iri: Optional[str] = None) -> {}:
-    et = path_to_file_or_etree if not isinstance(path_to_file_or_etree, Path) else etree.parse(path_to_file_or_etree)
-
-    if profile is None:
-        profile = get_metadata_profile(et)
-
-    if doc_iri is None:
-        doc_iri = make_record_iri(get_id(et, profile))
-
+def get_profile_prefixes(profile) -> (str, str, dict):
     if profile in [Profile.ISO19139, Profile.SEADATANET]:
         prefix = "gmd"
         prefix_2 = "gmd"
@@ -236,10 +264,24 @@ def get_thes_and_kws(path_to_file_or_etree: Union[Path, etree], profile: Optiona
         prefix_2 = "gmd"
         namespaces = {**NAMESPACES, **NAMESPACES_19139}
 
+    return prefix, prefix_2, namespaces
+
+
+def get_thes_and_kws(path_to_file_or_etree: Union[Path, etree], profile: Optional[Profile] = None, doc_iri: Optional[str] = None) -> {}:
+    et = path_to_file_or_etree if not isinstance(path_to_file_or_etree, Path) else etree.parse(path_to_file_or_etree)
+
+    if profile is None:
+        profile = get_metadata_profile(et)
+
+    if doc_iri is None:
+        doc_iri = make_record_iri(get_id(et, profile))
+
+    prefix, prefix_2, namespaces = get_profile_prefixes(profile)
+
     theses = {}
 
     keyword_sets = et.xpath(
-        "//gmd:MD_Keywords",
+        f"//{prefix}:MD_Keywords",
         namespaces=namespaces,
     )
     for keyword_set in keyword_sets:
@@ -273,26 +315,67 @@ def get_thes_and_kws(path_to_file_or_etree: Union[Path, etree], profile: Optiona
     return doc_iri, theses
 
 
+def is_well_known_iri(kw_iri: str) -> bool:
+    if "https://www.ncei.noaa.gov/archive/accession/" in kw_iri:
+        return True
+    if "https://www.ncei.noaa.gov/archive/archive-management-system" in kw_iri:
+        return True
+    if kw_iri.startswith("http://vocab.nerc.ac.uk"):
+        return True
+    return False
+
+
+def verify_concept_iris(iris: set) -> dict:
+    # the graphs each IRI is a skos:Concept with a prefLabel in, None standing for the default graph
+    if KB_INDEX is not None:
+        return {iri: KB_INDEX.graphs(iri) for iri in iris}
+
+    # IRIs that can't be written in a query are left for match_kw_to_kb to fail on individually
+    iris = sorted(iri for iri in iris if not any(c in iri for c in ' \t\n\r<>"{}|^`\\'))
+    graphs = {}
+    for i in range(0, len(iris), VERIFY_BATCH_SIZE):
+        batch = iris[i:i + VERIFY_BATCH_SIZE]
+        q = """
+            PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+
+            SELECT DISTINCT ?iri ?g
+            WHERE {
+              VALUES ?iri { XXX }
+              { ?iri a skos:Concept ; skos:prefLabel ?pl . }
+              UNION
+              { GRAPH ?g { ?iri a skos:Concept ; skos:prefLabel ?pl . } }
+            }
+            """.replace("XXX", " ".join(f"<{iri}>" for iri in batch))
+        for iri in batch:
+            graphs[iri] = set()
+        for row in send_query_to_db(q):
+            graphs[row["iri"]["value"]].add(row["g"]["value"] if "g" in row else None)
+
+    return graphs
+
+
 def match_kw_to_kb(kw_text: str, kw_iri: str = None, thes_iri: str = None) -> str:
+    return match_kw_to_kb_with_tier(kw_text, kw_iri, thes_iri)[0]
+
+
+def match_kw_to_kb_with_tier(kw_text: str, kw_iri: str = None, thes_iri: str = None, iri_graphs: dict = None) -> (str, str):
+    # as match_kw_to_kb but also returns the name of the matching tier that produced the value
+    # iri_graphs, from verify_concept_iris, saves querying the KB for each concept IRI
     if kw_iri is None and kw_text is None:
-        return None
+        return None, None
 
     # try cache
-    x = cache_get(kw_text, thes_iri)
+    # entries warmed from N-Triples outputs, or cached before tiers were, don't know the tier that matched them
+    x, tier = cache_get_with_tier(kw_text, thes_iri)
     if x is not None:
-        return x
+        return x, tier if tier is not None else "cache"
 
     # try well-known IRIs
-    if kw_iri is not None:
-        if "https://www.ncei.noaa.gov/archive/accession/" in kw_iri:
-            return kw_iri
-        if "https://www.ncei.noaa.gov/archive/archive-management-system" in kw_iri:
-            return kw_iri
-        if kw_iri.startswith("http://vocab.nerc.ac.uk"):
-            return kw_iri
+    if kw_iri is not None and is_well_known_iri(kw_iri):
+        return kw_iri, "well-known"
 
     if kw_iri is not None and kw_text is None:
-        return kw_iri
+        return kw_iri, "iri"
 
     # tidy the text
     if kw_text.startswith("What:"):
@@ -307,7 +390,11 @@ def match_kw_to_kb(kw_text: str, kw_iri: str = None, thes_iri: str = None) -> st
         kw_text = kw_text.split(">")[-1].strip()
 
     # try matching to an ID (notation)
-    if "_" in kw_text:
+    if "_" in kw_text and KB_INDEX is not None:
+        r = KB_INDEX.get("pref_en", None, kw_text)
+        if len(r) > 0:
+            return r[0], "notation"
+    elif "_" in kw_text:
         # this looks like an ID, so try to match it to a notation
         q = """
             PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
@@ -324,15 +411,20 @@ def match_kw_to_kb(kw_text: str, kw_iri: str = None, thes_iri: str = None) -> st
         r = send_query_to_db(q)
 
         if len(r) > 0:
-            return r[0]["iri"]["value"]
+            return r[0]["iri"]["value"], "notation"
 
     # we haven't nicely matched it to an ID, so remove the "_" to allow for better text matching
     kw_text = kw_text.replace("_", " ")
 
 
-    # searching by IRI
-    if thes_iri is not None:
+    # searching by IRI, already done if the IRI has been verified
+    if kw_iri is not None and iri_graphs is not None and kw_iri in iri_graphs:
+        if thes_iri in iri_graphs[kw_iri]:
+            return kw_iri, "thesaurus-iri" if thes_iri is not None else "iri"
+        q = None
+    elif thes_iri is not None:
         if kw_iri is not None:
+            tier = "thesaurus-iri"
             q = """
                 PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
 
@@ -352,63 +444,100 @@ def match_kw_to_kb(kw_text: str, kw_iri: str = None, thes_iri: str = None) -> st
                 LIMIT 3
                 """.replace("XXX", thes_iri).replace("YYY", kw_iri)
         else:
-            q = """
-                PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
-                
-                SELECT ?iri ?pl ?weight
-                WHERE {
-                  GRAPH <YYY> {
-                    {
-                      BIND (10 AS ?weight)
-                      ?iri 
-                        a skos:Concept ; 
-                          skos:notation ?pl ;
-                       .
-                       FILTER (STR(?pl) = "ZZZ")
-                    }
-                    UNION    
-                    {
-                      BIND (9 AS ?weight)
-                      ?iri 
-                        a skos:Concept ; 
-                          skos:prefLabel ?pl ;
-                      .
-                      FILTER (STR(?pl) = "ZZZ")
+            tier = "thesaurus-label"
+            # the index covers the exact notation and label matches, leaving the query for the REGEX ones
+            if KB_INDEX is not None:
+                for kind in ["notation", "pref", "alt"]:
+                    r = KB_INDEX.get(kind, thes_iri, kw_text)
+                    if len(r) > 0:
+                        return r[0], tier
+                q = """
+                    PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+
+                    SELECT ?iri ?pl ?weight
+                    WHERE {
+                      GRAPH <YYY> {
+                        {
+                         BIND (7 AS ?weight)
+                         ?iri
+                           a skos:Concept ;
+                             skos:prefLabel ?pl ;
+                          .
+                          FILTER (REGEX (?pl, "ZZZ", "i"))
+                        }
+                        UNION
+                        {
+                         BIND (6 AS ?weight)
+                         ?iri
+                           a skos:Concept ;
+                             skos:altLabel ?pl ;
+                          .
+                          FILTER (REGEX (?pl, "ZZZ", "i"))
+                        }
+                      }
                     }
-                    UNION
-                    {
-                      BIND (8 AS ?weight)
-                      ?iri 
-                        a skos:Concept ; 
-                          skos:altLabel ?pl ;
-                       .
-                       FILTER (STR(?pl) = "ZZZ")
-                    }    
-                    UNION 
-                    {
-                     BIND (7 AS ?weight)
-                     ?iri 
-                       a skos:Concept ; 
-                         skos:prefLabel ?pl ;
-                      .
-                      FILTER (REGEX (?pl, "ZZZ", "i"))
+                    ORDER BY DESC(?weight)
+                    LIMIT 3
+                    """.replace("YYY", thes_iri).replace("ZZZ", kw_text)
+            else:
+                q = """
+                    PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+                
+                    SELECT ?iri ?pl ?weight
+                    WHERE {
+                      GRAPH <YYY> {
+                        {
+                          BIND (10 AS ?weight)
+                          ?iri 
+                            a skos:Concept ; 
+                              skos:notation ?pl ;
+                           .
+                           FILTER (STR(?pl) = "ZZZ")
+                        }
+                        UNION    
+                        {
+                          BIND (9 AS ?weight)
+                          ?iri 
+                            a skos:Concept ; 
+                              skos:prefLabel ?pl ;
+                          .
+                          FILTER (STR(?pl) = "ZZZ")
+                        }
+                        UNION
+                        {
+                          BIND (8 AS ?weight)
+                          ?iri 
+                            a skos:Concept ; 
+                              skos:altLabel ?pl ;
+                           .
+                           FILTER (STR(?pl) = "ZZZ")
+                        }    
+                        UNION 
+                        {
+                         BIND (7 AS ?weight)
+                         ?iri 
+                           a skos:Concept ; 
+                             skos:prefLabel ?pl ;
+                          .
+                          FILTER (REGEX (?pl, "ZZZ", "i"))
+                        }
+                        UNION 
+                        {
+                         BIND (6 AS ?weight)
+                         ?iri 
+                           a skos:Concept ; 
+                             skos:altLabel ?pl ;
+                          .
+                          FILTER (REGEX (?pl, "ZZZ", "i"))
+                        }      
+                      }
                     }
-                    UNION 
-                    {
-                     BIND (6 AS ?weight)
-                     ?iri 
-                       a skos:Concept ; 
-                         skos:altLabel ?pl ;
-                      .
-                      FILTER (REGEX (?pl, "ZZZ", "i"))
-                    }      
-                  }
-                }
-                ORDER BY DESC(?weight)
-                LIMIT 3        
-                """.replace("YYY", thes_iri).replace("ZZZ", kw_text)
+                    ORDER BY DESC(?weight)
+                    LIMIT 3        
+                    """.replace("YYY", thes_iri).replace("ZZZ", kw_text)
     else:
         if kw_iri is not None:
+            tier = "iri"
             q = """
                 PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
 
@@ -426,6 +555,7 @@ def match_kw_to_kb(kw_text: str, kw_iri: str = None, thes_iri: str = None) -> st
                 LIMIT 3
                 """.replace("YYY", kw_iri)
         else:
+            tier = "text-search"
             q = """
                 PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
                 PREFIX text:    <http://jena.apache.org/text#>
@@ -440,10 +570,10 @@ def match_kw_to_kb(kw_text: str, kw_iri: str = None, thes_iri: str = None) -> st
                 LIMIT 3
                 """.replace("ZZZ", kw_text.replace(":", " ").replace(",", ""))
 
-    r = send_query_to_db(q)
+    r = send_query_to_db(q) if q is not None else []
 
     if len(r) > 0:
-        return r[0]["iri"]["value"]
+        return r[0]["iri"]["value"], tier
 
 
     # if the kw_text is really an IRI
@@ -458,7 +588,7 @@ def match_kw_to_kb(kw_text: str, kw_iri: str = None, thes_iri: str = None) -> st
             """.replace("XXX", kw_iri)
 
         if send_query_to_db(q):
-            return kw_iri
+            return kw_iri, "ask"
 
 
     # full-text search using value
@@ -480,10 +610,10 @@ def match_kw_to_kb(kw_text: str, kw_iri: str = None, thes_iri: str = None) -> st
         r = send_query_to_db(q)
 
         if len(r) > 0:
-            return r[0]["iri"]["value"]
+            return r[0]["iri"]["value"], "text-search"
 
     # got nuthin' so return original text
-    return kw_text
+    return kw_text, "unmatched"
 
 
 def get_best_guess_kws(path_to_file_or_etree: Union[Path, etree]):
@@ -491,23 +621,47 @@ def get_best_guess_kws(path_to_file_or_etree: Union[Path, etree]):
 
     doc_iri, thesauri = get_thes_and_kws(et)
 
+    # verify all the record's uncached concept IRIs at once
+    iris = set()
+    for thesaurus, content in thesauri.items():
+        thesaurus = None if thesaurus in ("empty", None) else thesaurus
+        for kw in content["keywords"]:
+            if kw["value"].startswith("http") and not is_well_known_iri(kw["value"]) and cache_get(kw["value"], thesaurus) is None:
+                iris.add(kw["value"])
+    try:
+        iri_graphs = verify_concept_iris(iris) if len(iris) > 0 else None
+    except QueryError:
+        # fall back to verifying them one by one
+        iri_graphs = None
+
+    errors = []
     for thesaurus, content in thesauri.items():
-        thesaurus = None if thesaurus == "empty" else thesaurus
+        # keyword sets whose thesaurus could not be identified at all are keyed None, not "empty"
+        thesaurus = None if thesaurus in ("empty", None) else thesaurus
 
         improved_kws = []
         for kw in content["keywords"]:
             kw_iri = kw["value"] if kw["value"].startswith("http") else None
-            val = match_kw_to_kb(kw["value"], kw_iri, thesaurus)
+            try:
+                val, tier = match_kw_to_kb_with_tier(kw["value"], kw_iri, thesaurus, iri_graphs)
+            except QueryError as e:
+                # carry on with the other keywords so that their results are cached before the record is quarantined
+                errors.append({"keyword": kw["value"], "thesaurus": thesaurus, "error": str(e), "query": e.query})
+                continue
 
             theme = kw["theme"]
             improved_kws.append({
                 "value": val,
                 "theme": theme,
                 "thesaurus": thesaurus,
-                "original": kw["value"]
+                "original": kw["value"],
+                "tier": tier
             })
 
-        thesauri["empty" if thesaurus is None else thesaurus]["keywords"] = improved_kws
+        content["keywords"] = improved_kws
+
+    if len(errors) > 0:
+        raise RecordError(doc_iri, errors)
 
     return doc_iri, thesauri
 
@@ -546,18 +700,31 @@ def present_results(thesauri):
     print(table)
 
 
+def cache_add_entry(original, thesaurus, value, tier):
+    # KW_CACHE entries are (original, thesaurus, value, tier), or (original, thesaurus, value) if the tier isn't known
+    if tier in (None, "cache"):
+        if (original, thesaurus) in KW_INDEX:
+            return
+        KW_CACHE.add((original, thesaurus, value))
+    else:
+        KW_CACHE.discard((original, thesaurus, value))
+        KW_CACHE.add((original, thesaurus, value, tier))
+    KW_INDEX[(original, thesaurus)] = (value, tier)
+
+
 def cache_add(thesauri):
     for thesaurus, content in thesauri.items():
         for kw in content["keywords"]:
-            KW_CACHE.add((kw["original"], kw["thesaurus"], kw["value"]))
+            # a cache hit's tier is that of the match it was cached from
+            cache_add_entry(kw["original"], kw["thesaurus"], kw["value"], kw.get("tier"))
 
 
 def cache_get(value, thesaurus):
-    for entry in KW_CACHE:
-        if entry[0] == value and entry[1] == thesaurus:
-            return entry[2]
-    else:
-        return None
+    return cache_get_with_tier(value, thesaurus)[0]
+
+
+def cache_get_with_tier(value, thesaurus):
+    return KW_INDEX.get((value, thesaurus), (None, None))
 
 
 def thes_cache_get(thes_iri):
@@ -607,12 +774,12 @@ def convert_results_to_graph(thesauri: {}, doc_iri: str) -> Graph:
     return g
 
 
-def cache_prep(kw_cache_file, KW_CACHE):
+def cache_prep(kw_cache_file, KW_CACHE, warm_files=()):
     if len(KW_CACHE) == 0:
         if Path(kw_cache_file).is_file():
-            KW_CACHE = pickle.load(open(kw_cache_file, "rb"))
+            KW_CACHE.update(pickle.load(open(kw_cache_file, "rb")))
         else:
-            KW_CACHE = [
+            KW_CACHE.update([
                 ("earth science > paleoclimate > tree ring",
                  "https://gcmd.earthdata.nasa.gov/kms/concepts/concept_scheme/sciencekeywords ",
                  "https://gcmd.earthdata.nasa.gov/kms/concept/0e06e528-e796-4b7c-9878-dbcb061d878d"),
@@ -621,22 +788,136 @@ def cache_prep(kw_cache_file, KW_CACHE):
                 ("What: tree ring standardized growth index; Material: null",
                  "https://www.ncei.noaa.gov/access/paleo-search/cvterms?termId=682"),
                 ("What: age; Material: null", "https://www.ncei.noaa.gov/access/paleo-search/cvterms?termId=241")
-            ]
-            pickle.dump(KW_CACHE, open(kw_cache_file, "wb"))
+            ])
+            pickle_store(KW_CACHE, kw_cache_file)
+
+    # warm the cache from previous runs' outputs, match results files keeping the tier that matched each keyword
+    for warm_file in warm_files:
+        if Path(warm_file).suffix in (".csv", ".parquet"):
+            KW_CACHE.update(read_match_results(warm_file))
+        else:
+            KW_CACHE.update(read_kw_cache_entries(warm_file))
+
+    KW_INDEX.clear()
+    for entry in KW_CACHE:
+        # prefer entries that know their tier
+        if len(entry) == 4 or (len(entry) == 3 and (entry[0], entry[1]) not in KW_INDEX):
+            KW_INDEX[(entry[0], entry[1])] = (entry[2], entry[3] if len(entry) == 4 else None)
+    KW_CACHE.difference_update([(k[0], k[1], v[0]) for k, v in KW_INDEX.items() if v[1] is not None])
 
     print(f"KW_CACHE: {len(KW_CACHE)}")
 
 
 def cache_store(kw_cache_file, KW_CACHE):
-    pickle.dump(KW_CACHE, open(kw_cache_file, "wb"))
+    pickle_store(KW_CACHE, kw_cache_file)
+
+
+def quarantine_add(quarantine_file: Path, record: Path, e: Exception):
+    if isinstance(e, RecordError):
+        entry = {"record": str(record), "doc_iri": e.doc_iri, "errors": e.errors}
+    else:
+        entry = {
+            "record": str(record),
+            "doc_iri": None,
+            "errors": [{"error": f"{type(e).__name__}: {e}", "query": getattr(e, "query", None)}]
+        }
+    with open(quarantine_file, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def quarantine_records(quarantine_file: Path) -> List[Path]:
+    # a dict keeps the records in order without duplicates
+    records = {}
+    if not Path(quarantine_file).is_file():
+        return []
+    with open(quarantine_file) as f:
+        for line in f:
+            if line.strip() != "":
+                records[Path(json.loads(line)["record"])] = None
+    return list(records)
+
+
+def quarantine_retry_start(quarantine_file: Path) -> (List[Path], Path, Path):
+    # moves the quarantined records to a ".retrying" file, so that records that fail again are re-quarantined into
+    # a fresh quarantine file, and returns those yet to be retried with the retrying file and the ".retried" file,
+    # which process_records lists retried records in, to delete once the retry has finished
+    # a retrying file left by a retry that didn't finish still lists the records that retry never reached, so the
+    # quarantine file is added to it rather than replacing it, and the records it did retry are skipped
+    retrying_file = quarantine_file.with_suffix(".retrying.jsonl")
+    retried_file = quarantine_file.with_suffix(".retried.jsonl")
+    if quarantine_file.is_file():
+        with open(retrying_file, "a") as f:
+            f.write(quarantine_file.read_text())
+        quarantine_file.unlink()
+
+    retried = set(quarantine_records(retried_file))
+    return [r for r in quarantine_records(retrying_file) if r not in retried], retrying_file, retried_file
+
+
+def quarantine_retried(retried_file: Path, records: List[Path]):
+    with open(retried_file, "a") as f:
+        for record in records:
+            f.write(json.dumps({"record": str(record)}) + "\n")
+
+
+def process_records(records: List[Path], resulting_nt_file: Path, quarantine_file: Path,
+                    results_writer: MatchResultsWriter, quiet: bool = False, retried_file: Path = None) -> (int, int):
+    # with a retried_file, records that succeed are listed in it once their results have been written out, i.e.
+    # when results_writer flushes, so that an interrupted retry doesn't write them twice when it is run again
+    count = 0
+    failed = 0
+    retried = []
+    for r in records:
+        if not quiet:
+            print(r)
+        # get the KWs
+        try:
+            doc_iri, thesauri = get_best_guess_kws(r)
+            nt = convert_results_to_graph(thesauri, doc_iri).serialize(format="nt")
+        except Exception as e:
+            print(f"quarantined: {e}")
+            quarantine_add(quarantine_file, r, e)
+            failed += 1
+            continue
+        # print the results to screen
+        if not quiet:
+            present_results(thesauri)
+        results_writer.add(doc_iri, thesauri)
+        if retried_file is not None:
+            retried.append(r)
+            if len(results_writer.rows) == 0:
+                quarantine_retried(retried_file, retried)
+                retried = []
+        # save the results to an RDF file
+        with open(resulting_nt_file, "a") as f:
+            f.write(nt)
+            f.write("\n\n")
+        # put results in the cache
+        cache_add(thesauri)
+
+        count += 1
+        if not quiet or count % 1000 == 0:
+            print(f"record no. {count}")
+            print(f"cache len. {len(KW_CACHE)}")
+
+    if retried_file is not None:
+        results_writer.flush()
+        quarantine_retried(retried_file, retried)
+
+    return count, failed
 
 
 if __name__ == "__main__":
-    THES_CACHE = set()
-    KW_CACHE = set()
     kw_cache_file = "KW_CACHE.p"
+    query_cache_file = "QUERY_CACHE.p"
+    # existing outputs to warm the keyword cache from, e.g. Path(__file__).parent / "cmems-keywords.nt.gz"
+    # or, to keep the tiers that matched the keywords, Path(__file__).parent / "cmems-matches.csv"
+    warm_files = []
 
-    cache_prep(kw_cache_file, KW_CACHE)
+    cache_prep(kw_cache_file, KW_CACHE, warm_files)
+    query_cache_prep(query_cache_file)
+    # build with kb_index.py to verify concept IRIs and look up exact notation and label matches locally
+    KB_INDEX = kb_index_open(KB_INDEX_FILE)
 
     t1_start = perf_counter()
 
@@ -683,27 +964,33 @@ if __name__ == "__main__":
 
     folder = "capital"
     resulting_nt_file = Path(__file__).parent / f"{folder}-keywords.nt"
-    records = sorted(Path(f"/home/nick/work/bodc/sa-records/{folder}").glob("*.xml"))
+    quarantine_file = Path(__file__).parent / f"{folder}-quarantine.jsonl"
+    # use a .parquet file if pyarrow is installed
+    results_file = Path(__file__).parent / f"{folder}-matches.csv"
+    # set to True to suppress the per-record tables and progress messages
+    quiet = False
+    # set to True to reprocess only the records that failed in previous runs
+    retry = False
+    retried_file = None
+    if retry:
+        records, retrying_file, retried_file = quarantine_retry_start(quarantine_file)
+        print(f"retrying {len(records)} quarantined record(s)")
+    else:
+        records = sorted(Path(f"/home/nick/work/bodc/sa-records/{folder}").glob("*.xml"))
     start = 0
-    count = 0
-    for r in records[start:]:
-        print(r)
-        # get the KWs
-        doc_iri, thesauri = get_best_guess_kws(r)
-        # print the results to screen
-        present_results(thesauri)
-        # save the results to an RDF file
-        with open(resulting_nt_file, "a") as f:
-            f.write(convert_results_to_graph(thesauri, doc_iri).serialize(format="nt"))
-            f.write("\n\n")
-        # put results in the cache
-        cache_add(thesauri)
+    results_writer = MatchResultsWriter(results_file)
+    count, failed = process_records(
+        records[start:], resulting_nt_file, quarantine_file, results_writer, quiet, retried_file
+    )
+    results_writer.close()
 
-        count += 1
-        print(f"record no. {count}")
-        print(f"cache len. {len(KW_CACHE)}")
+    if retry:
+        retrying_file.unlink(missing_ok=True)
+        retried_file.unlink(missing_ok=True)
+    print(f"quarantined {failed} record(s) to {quarantine_file}")
 
     cache_store(kw_cache_file, KW_CACHE)
+    query_cache_store(query_cache_file)
 
     t1_stop = perf_counter()
     print("Elapsed time :", t1_stop - t1_start)
@@ -0,0 +1,219 @@
+# a compact, read-only, on-disk index of the KB's exact-match lookups - concept notations and labels per graph,
+# the graphs each concept IRI is in, and the system graph's thesaurus aliases and labels - used by match_kw_to_kb,
+# verify_concept_iris and match_thes_to_kb in place of their exact-match SPARQL queries
+#
+# the file is memory-mapped, not loaded, so opening it takes milliseconds and processes using it share its
+# pages through the OS page cache rather than each holding a copy. Its layout is:
+#   MAGIC, n (uint32), kb_version length (uint32), kb_version,
+#   n + 1 entry offsets (uint64), relative to the start of the entries,
+#   n entries, sorted by key, each of key NUL value
+# a key is KIND US GRAPH US LABEL, GRAPH being empty for the default graph, and a value is one or more RS
+# separated strings. "concept" keys have an empty GRAPH and the concept IRI as their LABEL, and their values are
+# the graphs the concept is in, the empty string standing for the default graph
+#
+#   python kb_index.py [KB_INDEX_FILE]   - build the index from the KB
+
+import mmap
+import struct
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from utils import send_query_to_db, get_kb_version
+
+KB_INDEX_FILE = "KB_INDEX.bin"
+MAGIC = b"SAKBIDX1"
+US = "\x1f"
+RS = "\x1e"
+
+
+def index_key(kind: str, graph: Optional[str], label: str) -> bytes:
+    return f"{kind}{US}{graph or ''}{US}{label}".encode()
+
+
+class KbIndex:
+    def __init__(self, kb_index_file: Path):
+        self.f = open(kb_index_file, "rb")
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{kb_index_file} is not a KB index")
+        self.n, version_length = struct.unpack_from("<II", self.mm, len(MAGIC))
+        version_start = len(MAGIC) + 8
+        self.kb_version = self.mm[version_start:version_start + version_length].decode()
+        self.offsets_start = version_start + version_length
+        self.entries_start = self.offsets_start + 8 * (self.n + 1)
+
+    def entry(self, i: int) -> (bytes, int, int):
+        start, end = struct.unpack_from("<QQ", self.mm, self.offsets_start + 8 * i)
+        start += self.entries_start
+        end += self.entries_start
+        sep = self.mm.find(b"\x00", start, end)
+        return self.mm[start:sep], sep + 1, end
+
+    def get(self, kind: str, graph: Optional[str], label: str) -> List[str]:
+        key = index_key(kind, graph, label)
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key, value_start, value_end = self.entry(mid)
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return self.mm[value_start:value_end].decode().split(RS)
+        return []
+
+    def graphs(self, iri: str) -> set:
+        # the graphs the concept is in, None standing for the default graph, or an empty set if it's unknown
+        return {graph if graph != "" else None for graph in self.get("concept", None, iri)}
+
+    def close(self):
+        self.mm.close()
+        self.f.close()
+
+
+def kb_index_open(kb_index_file: Path, kb_version: str = None) -> Optional[KbIndex]:
+    if not Path(kb_index_file).is_file():
+        return None
+
+    kb_version = kb_version or get_kb_version()
+    if kb_version is None:
+        print("KB_INDEX: the KB version is unknown, not loading")
+        return None
+
+    index = KbIndex(kb_index_file)
+    if index.kb_version != kb_version:
+        print(f"KB_INDEX: built for KB version {index.kb_version}, not {kb_version}, ignoring")
+        index.close()
+        return None
+
+    return index
+
+
+def write_kb_index(kb_index_file: Path, entries: dict, kb_version: str = None) -> int:
+    # entries maps keys, from index_key(), to sets of values
+    kb_version = kb_version or get_kb_version()
+    if kb_version is None:
+        raise ValueError("the KB version is unknown, so an index of it could never be loaded")
+    keys = sorted(entries.keys())
+    data = [k + b"\x00" + RS.join(sorted(entries[k])).encode() for k in keys]
+
+    offsets = [0]
+    for d in data:
+        offsets.append(offsets[-1] + len(d))
+
+    version = kb_version.encode()
+    with open(kb_index_file, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<II", len(keys), len(version)))
+        f.write(version)
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        f.writelines(data)
+
+    return len(keys)
+
+
+def is_plain(literal: dict) -> bool:
+    # only plain string literals are equal to the untagged strings the thesaurus queries compare labels with
+    return "xml:lang" not in literal and literal.get("datatype") in (None, "http://www.w3.org/2001/XMLSchema#string")
+
+
+def build_kb_index(kb_index_file: Path, kb_version: str = None) -> int:
+    entries = {}
+
+    def add(kind, graph, label, value):
+        entries.setdefault(index_key(kind, graph, label), set()).add(value)
+
+    graphs = [row["g"]["value"] for row in send_query_to_db("""
+        PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+
+        SELECT DISTINCT ?g
+        WHERE {
+          GRAPH ?g { ?iri a skos:Concept . }
+        }
+        """, cache=False)]
+
+    # concept notations and labels in each vocabulary's graph, as matched by match_kw_to_kb's thesaurus query
+    for graph in graphs:
+        for kind, predicate in [("notation", "skos:notation"), ("pref", "skos:prefLabel"), ("alt", "skos:altLabel")]:
+            q = """
+                PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+
+                SELECT ?iri ?l
+                WHERE {
+                  GRAPH <XXX> { ?iri a skos:Concept ; YYY ?l . }
+                }
+                """.replace("XXX", graph).replace("YYY", predicate)
+            for row in send_query_to_db(q, cache=False):
+                add(kind, graph, row["l"]["value"], row["iri"]["value"])
+
+    # concepts with a prefLabel in each graph, and in the default graph, as verified by verify_concept_iris
+    for graph in [None] + graphs:
+        q = """
+            PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+
+            SELECT DISTINCT ?iri
+            WHERE {
+              GRAPH <XXX> { ?iri a skos:Concept ; skos:prefLabel ?pl . }
+            }
+            """.replace("XXX", graph) if graph is not None else """
+            PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+
+            SELECT DISTINCT ?iri
+            WHERE {
+              ?iri a skos:Concept ; skos:prefLabel ?pl .
+            }
+            """
+        for row in send_query_to_db(q, cache=False):
+            add("concept", None, row["iri"]["value"], graph or "")
+
+    # English prefLabels in the default graph, as matched by match_kw_to_kb's notation-like ID query
+    q = """
+        PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+
+        SELECT ?iri ?l
+        WHERE {
+          ?iri a skos:Concept ; skos:prefLabel ?l .
+          FILTER (LANG(?l) = "en")
+        }
+        """
+    for row in send_query_to_db(q, cache=False):
+        add("pref_en", None, row["l"]["value"], row["iri"]["value"])
+
+    # thesaurus aliases and labels in the system graph, as matched by match_thes_to_kb
+    q = """
+        PREFIX sa: <https://w3id.org/semanticanalyser/>
+        PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+
+        SELECT ?iri ?alias ?name
+        WHERE {
+          GRAPH sa:system-graph {
+            ?iri sa:hasAlias ?alias ;
+                skos:prefLabel ?name .
+          }
+        }
+        """
+    for row in send_query_to_db(q, cache=False):
+        add("thes_alias", None, row["alias"]["value"], row["iri"]["value"] + US + row["name"]["value"])
+
+    for kind, predicate in [("thes_pref", "skos:prefLabel"), ("thes_alt", "skos:altLabel")]:
+        q = """
+            PREFIX sa: <https://w3id.org/semanticanalyser/>
+            PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+
+            SELECT ?iri ?l
+            WHERE {
+              GRAPH sa:system-graph { ?iri YYY ?l . }
+            }
+            """.replace("YYY", predicate)
+        for row in send_query_to_db(q, cache=False):
+            if is_plain(row["l"]):
+                add(kind, None, row["l"]["value"], row["iri"]["value"] + US + row["l"]["value"])
+
+    return write_kb_index(kb_index_file, entries, kb_version)
+
+
+if __name__ == "__main__":
+    kb_index_file = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(KB_INDEX_FILE)
+    print(f"KB_INDEX: {build_kb_index(kb_index_file)} keys")
@@ -0,0 +1,112 @@
+# this script merges the per-record N-Triples output of extract.py - one or more *-keywords.nt(.gz) files -
+# into a single, sorted, deduplicated and gzipped N-Triples file
+#
+# each record's blank nodes are relabelled deterministically from their content so that identical
+# keyword nodes, and citations of the same concept based on the same original value, collapse into one
+# node across records. Deduplication then uses an external sort so memory is bounded by CHUNK_LINES
+
+import gzip
+import heapq
+import re
+import sys
+import tempfile
+from hashlib import sha1
+from pathlib import Path
+from typing import List
+
+from utils import read_nt_lines
+
+CHUNK_LINES = 1_000_000
+
+TRIPLE = re.compile(r"^(\S+) (\S+) (.*) \.\s*$")
+CITATION = "<https://schema.org/citation>"
+IS_BASED_ON = "<https://schema.org/isBasedOn>"
+
+
+def canonicalise_block(triples: List[tuple]) -> List[str]:
+    # a blank node's label is a hash of its own statements, ignoring which record it is based on,
+    # plus the concept citing it, so citations of a concept are consolidated per original value
+    signatures = {}
+    for s, p, o in triples:
+        if s.startswith("_:") and p != IS_BASED_ON:
+            signatures.setdefault(s, []).append(f"{p} {o}")
+        if o.startswith("_:") and p == CITATION:
+            signatures.setdefault(o, []).append(f"^{s}")
+
+    labels = {}
+    for bnode, signature in signatures.items():
+        labels[bnode] = "_:b" + sha1("\n".join(sorted(signature)).encode()).hexdigest()
+
+    lines = []
+    for s, p, o in triples:
+        lines.append(f"{labels.get(s, s)} {p} {labels.get(o, o)} .\n")
+
+    return lines
+
+
+def read_canonical_lines(nt_file: Path):
+    block = []
+    for line in read_nt_lines(nt_file):
+        m = TRIPLE.match(line)
+        if m is not None:
+            block.append(m.groups())
+        elif line.strip() == "" and len(block) > 0:
+            # blank lines separate the output of each record
+            yield from canonicalise_block(block)
+            block = []
+    if len(block) > 0:
+        yield from canonicalise_block(block)
+
+
+def write_sorted_chunk(lines: List[str], chunk_dir: Path, n: int) -> Path:
+    chunk_file = chunk_dir / f"chunk-{n:05}.nt"
+    with open(chunk_file, "w", encoding="utf-8") as f:
+        f.writelines(sorted(set(lines)))
+    return chunk_file
+
+
+def merge_nt_files(nt_files: List[Path], output_file: Path, chunk_lines: int = CHUNK_LINES) -> dict:
+    stats = {"input_lines": 0, "input_bytes": 0, "output_lines": 0, "output_bytes": 0}
+
+    with tempfile.TemporaryDirectory() as chunk_dir:
+        chunk_files = []
+        lines = []
+        for nt_file in nt_files:
+            stats["input_bytes"] += Path(nt_file).stat().st_size
+            for line in read_canonical_lines(nt_file):
+                lines.append(line)
+                stats["input_lines"] += 1
+                if len(lines) >= chunk_lines:
+                    chunk_files.append(write_sorted_chunk(lines, Path(chunk_dir), len(chunk_files)))
+                    lines = []
+        if len(lines) > 0:
+            chunk_files.append(write_sorted_chunk(lines, Path(chunk_dir), len(chunk_files)))
+
+        chunks = [open(chunk_file, encoding="utf-8") for chunk_file in chunk_files]
+        try:
+            with gzip.open(output_file, "wt", encoding="utf-8") as out:
+                previous = None
+                for line in heapq.merge(*chunks):
+                    if line != previous:
+                        out.write(line)
+                        stats["output_lines"] += 1
+                    previous = line
+        finally:
+            for chunk in chunks:
+                chunk.close()
+
+    stats["output_bytes"] = Path(output_file).stat().st_size
+    return stats
+
+
+if __name__ == "__main__":
+    # usage: python merge.py OUTPUT.nt.gz INPUT.nt[.gz] [INPUT.nt[.gz] ...]
+    output_file = Path(sys.argv[1])
+    nt_files = [Path(x) for x in sys.argv[2:]]
+
+    stats = merge_nt_files(nt_files, output_file)
+
+    print(f"triples: {stats['input_lines']} -> {stats['output_lines']}")
+    print(f"bytes on disk: {stats['input_bytes']} -> {stats['output_bytes']}")
+    if stats["input_bytes"] > 0:
+        print(f"size reduction: {100 * (1 - stats['output_bytes'] / stats['input_bytes']):.1f}%")
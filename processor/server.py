@@ -0,0 +1,179 @@
+# a long-running matching service that keeps the keyword, thesaurus and SPARQL response caches, and the
+# connections to the KB, warm between requests
+#
+#   POST /match  - body is an XML record, or a document containing several, e.g. a CSW GetRecordsResponse
+#                  returns the matched keywords as JSON or, with ?format=nt or Accept: application/n-triples,
+#                  as N-Triples
+#   GET  /stats  - request, record and cache counts
+
+import json
+import signal
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import perf_counter
+from urllib.parse import urlparse, parse_qs
+
+from lxml import etree
+
+from utils import NAMESPACES, NAMESPACES_19139, QUERY_CACHE, query_cache_prep, query_cache_store
+import extract
+from extract import get_best_guess_kws, convert_results_to_graph, cache_prep, cache_store, cache_add, RecordError, \
+    KW_CACHE, THES_CACHE
+from kb_index import kb_index_open, KB_INDEX_FILE
+
+HOST = "localhost"
+PORT = 8000
+MAX_BODY_BYTES = 100_000_000
+# the caches are saved this often, as well as on shutdown, so that a killed server loses little
+SAVE_INTERVAL = 300
+
+CACHE_LOCK = threading.Lock()
+STATS = {"started": perf_counter(), "requests": 0, "records": 0, "failed": 0, "keywords": 0}
+
+
+def split_records(body: bytes) -> list:
+    root = etree.fromstring(body, parser=etree.XMLParser(resolve_entities=False, no_network=True))
+    records = root.xpath(
+        "descendant-or-self::gmi:MI_Metadata | descendant-or-self::gmd:MD_Metadata | descendant-or-self::mdb:MD_Metadata",
+        namespaces={**NAMESPACES, **NAMESPACES_19139, "mdb": NAMESPACES["mdb"]},
+    )
+    if len(records) == 0 or records[0] is root:
+        return [etree.ElementTree(root)]
+
+    # each record needs to be its own document as the extraction XPaths search from the document root
+    outermost = [r for r in records if not any(a in records for a in r.iterancestors())]
+    return [etree.ElementTree(etree.fromstring(etree.tostring(r))) for r in outermost]
+
+
+def match_record(et) -> dict:
+    doc_iri = None
+    try:
+        doc_iri, thesauri = get_best_guess_kws(et)
+        # serialise here so that records the graph can't be made for, e.g. with whitespace in a thesaurus IRI,
+        # are failed like any other rather than breaking the whole response
+        nt = convert_results_to_graph(thesauri, doc_iri).serialize(format="nt")
+    except RecordError as e:
+        return {"record": e.doc_iri, "errors": e.errors}
+    except Exception as e:
+        return {
+            "record": str(doc_iri) if doc_iri is not None else None,
+            "errors": [{"error": f"{type(e).__name__}: {e}", "query": getattr(e, "query", None)}]
+        }
+
+    with CACHE_LOCK:
+        cache_add(thesauri)
+
+    return {"record": str(doc_iri), "thesauri": thesauri, "nt": nt}
+
+
+def save_caches(kw_cache_file, query_cache_file):
+    with CACHE_LOCK:
+        cache_store(kw_cache_file, KW_CACHE)
+    query_cache_store(query_cache_file)
+
+
+def save_caches_periodically(kw_cache_file, query_cache_file, stopped: threading.Event):
+    while not stopped.wait(SAVE_INTERVAL):
+        save_caches(kw_cache_file, query_cache_file)
+
+
+class MatchingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status: int, obj):
+        self.send_body(status, json.dumps(obj).encode(), "application/json")
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/stats":
+            return self.send_json(404, {"error": "not found"})
+
+        self.send_json(200, {
+            "uptime": perf_counter() - STATS["started"],
+            "requests": STATS["requests"],
+            "records": STATS["records"],
+            "failed": STATS["failed"],
+            "keywords": STATS["keywords"],
+            "kw_cache": len(KW_CACHE),
+            "thes_cache": len(THES_CACHE),
+            "query_cache": len(QUERY_CACHE),
+            "threads": threading.active_count(),
+        })
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/match":
+            return self.send_json(404, {"error": "not found"})
+
+        length = self.headers.get("Content-Length", "0")
+        length = int(length) if length.isdecimal() else 0
+        if length == 0 or length > MAX_BODY_BYTES:
+            # the body isn't read, so where the next request on the connection starts isn't known
+            self.close_connection = True
+            return self.send_json(400, {"error": f"a request body of 1 to {MAX_BODY_BYTES} bytes is required"})
+
+        try:
+            ets = split_records(self.rfile.read(length))
+        except etree.XMLSyntaxError as e:
+            return self.send_json(400, {"error": f"invalid XML: {e}"})
+
+        results = [match_record(et) for et in ets]
+        failed = [r for r in results if "errors" in r]
+
+        with CACHE_LOCK:
+            STATS["requests"] += 1
+            STATS["records"] += len(results)
+            STATS["failed"] += len(failed)
+            STATS["keywords"] += sum(len(c["keywords"]) for r in results for c in r.get("thesauri", {}).values())
+
+        fmt = parse_qs(url.query).get("format", [None])[0]
+        if fmt == "nt" or (fmt is None and "application/n-triples" in self.headers.get("Accept", "")):
+            nt = "".join(r["nt"] + "\n" for r in results if "nt" in r)
+            return self.send_body(200, nt.encode(), "application/n-triples", {"X-Failed-Records": str(len(failed))})
+
+        self.send_body(200, json.dumps([
+            r if "errors" in r else {
+                "record": r["record"],
+                "keywords": [
+                    {k: kw.get(k) for k in ["original", "value", "thesaurus", "theme", "tier"]}
+                    for content in r["thesauri"].values() for kw in content["keywords"]
+                ]
+            }
+            for r in results
+        ]).encode(), "application/json", {"X-Failed-Records": str(len(failed))})
+
+
+if __name__ == "__main__":
+    kw_cache_file = "KW_CACHE.p"
+    query_cache_file = "QUERY_CACHE.p"
+    warm_files = []
+
+    cache_prep(kw_cache_file, KW_CACHE, warm_files)
+    query_cache_prep(query_cache_file)
+    extract.KB_INDEX = kb_index_open(KB_INDEX_FILE)
+
+    server = ThreadingHTTPServer((HOST, PORT), MatchingHandler)
+    # shutdown() waits for serve_forever() to return, so it can't be called from the thread running it
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    stopped = threading.Event()
+    threading.Thread(
+        target=save_caches_periodically, args=(kw_cache_file, query_cache_file, stopped), daemon=True
+    ).start()
+
+    print(f"serving on http://{HOST}:{PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+        server.server_close()
+        save_caches(kw_cache_file, query_cache_file)
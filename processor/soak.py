@@ -0,0 +1,143 @@
+# runs a synthetic corpus through the matching pipeline, tracking memory and throughput over time, to catch
+# unbounded growth of the module-level caches or of per-record allocations
+#
+# the records are written out and run through extract.process_records in batches of INTERVAL, as extract.py runs
+# them. Like extract.py this needs the KB to be running, unless it is stubbed with --stub, which answers every query
+# as an empty KB would. Use duplication=1.0 for a corpus with a bounded set of unique keywords: once they have all
+# been seen the caches should stop growing, and so should memory. Otherwise the caches grow with the corpus, but
+# each new entry should cost a bounded amount of memory
+
+import csv
+import re
+import resource
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+
+import httpx
+
+import utils
+from utils import QUERY_CACHE
+from extract import process_records, KW_CACHE, KW_INDEX, THES_CACHE
+from synth import generate_records, parse_settings, DUPLICATION
+from tabular import MatchResultsWriter
+
+INTERVAL = 1000
+# memory growth allowed over the second half of a run in which the caches don't grow
+GROWTH_TOLERANCE = 0.1
+# in a run with a bounded set of unique keywords, the caches' growth rate over the last quarter of the run must have
+# fallen to this fraction of that over the first quarter, as the keywords (and their thesauri) are used up
+BOUNDED_GROWTH_RATIO = 0.25
+# memory allowed per new cache entry over the second half of a run in which the caches grow
+MAX_BYTES_PER_CACHE_ENTRY = 4096
+
+
+def cache_entries() -> int:
+    return len(KW_CACHE) + len(KW_INDEX) + len(THES_CACHE) + len(QUERY_CACHE)
+
+
+def stub_kb():
+    # queries still go through send_query_to_db, and QUERY_CACHE, but are answered as by an empty KB
+    def empty_kb(request: httpx.Request) -> httpx.Response:
+        if re.search(r"^\s*ASK\b", request.url.params.get("query", ""), re.MULTILINE | re.IGNORECASE):
+            return httpx.Response(200, json={"head": {}, "boolean": False})
+        return httpx.Response(200, json={"head": {"vars": []}, "results": {"bindings": []}})
+
+    utils.DB_CLIENT = httpx.Client(transport=httpx.MockTransport(empty_kb))
+
+
+def soak(n: int, samples_file: Path, interval: int = INTERVAL, seed: int = 0, **kwargs) -> list:
+    samples = []
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory() as out_dir:
+        out_dir = Path(out_dir)
+        results_writer = MatchResultsWriter(out_dir / "matches.csv")
+        t_start = t_last = perf_counter()
+        batch = []
+        for i, (name, et) in enumerate(generate_records(n, seed, **kwargs), start=1):
+            et.write(str(out_dir / name), xml_declaration=True, encoding="UTF-8")
+            batch.append(out_dir / name)
+
+            if i % interval == 0 or i == n:
+                process_records(batch, out_dir / "keywords.nt", out_dir / "quarantine.jsonl", results_writer, quiet=True)
+                for record in batch:
+                    record.unlink()
+                batch = []
+
+                now = perf_counter()
+                current, peak = tracemalloc.get_traced_memory()
+                samples.append({
+                    "records": i,
+                    "elapsed": round(now - t_start, 3),
+                    "records_per_sec": round((i - (samples[-1]["records"] if samples else 0)) / (now - t_last), 1),
+                    "traced_bytes": current,
+                    "traced_peak_bytes": peak,
+                    # kB on Linux
+                    "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                    "kw_cache": len(KW_CACHE),
+                    "thes_cache": len(THES_CACHE),
+                    "query_cache": len(QUERY_CACHE),
+                    "cache_entries": cache_entries(),
+                })
+                t_last = now
+                print(samples[-1])
+        results_writer.close()
+    tracemalloc.stop()
+
+    with open(samples_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(samples[0].keys()))
+        writer.writeheader()
+        writer.writerows(samples)
+
+    return samples
+
+
+def check_growth(samples: list, duplication: float = DUPLICATION) -> bool:
+    if len(samples) < 4:
+        print("too few samples to check growth")
+        return True
+
+    mid = samples[len(samples) // 2]
+    end = samples[-1]
+    memory_growth = (end["traced_bytes"] - mid["traced_bytes"]) / mid["traced_bytes"]
+    cache_growth = end["cache_entries"] - mid["cache_entries"]
+    records = end["records"] - mid["records"]
+    print(f"second half: {memory_growth:.1%} memory growth, {cache_growth / records:.3f} new cache entries per record, "
+          f"{(end['traced_bytes'] - mid['traced_bytes']) / records:.0f} bytes per record")
+
+    ok = True
+    if duplication >= 1.0:
+        first = samples[len(samples) // 4]
+        last = samples[-1 - len(samples) // 4]
+        first_rate = first["cache_entries"] / first["records"]
+        last_rate = (end["cache_entries"] - last["cache_entries"]) / (end["records"] - last["records"])
+        print(f"{first_rate:.3f} new cache entries per record over the first quarter, {last_rate:.3f} over the last")
+        if last_rate > BOUNDED_GROWTH_RATIO * first_rate:
+            print("the caches are not levelling off although the keywords are bounded - they are unbounded")
+            ok = False
+    if cache_growth == 0 and memory_growth > GROWTH_TOLERANCE:
+        print("memory is growing while the caches are not - per-record allocations are being retained")
+        ok = False
+    if cache_growth > 0:
+        bytes_per_entry = (end["traced_bytes"] - mid["traced_bytes"]) / cache_growth
+        print(f"{bytes_per_entry:.0f} bytes per new cache entry")
+        if bytes_per_entry > MAX_BYTES_PER_CACHE_ENTRY:
+            print("memory is growing faster than the caches - more is being retained than the cache entries")
+            ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    # usage: python soak.py NUMBER_OF_RECORDS [SAMPLES_CSV] [NAME=VALUE...] [--stub], NAMEs being synth.py's
+    # settings, e.g. python soak.py 10000 soak-samples.csv duplication=1.0 kw_max=10 --stub
+    args = [arg for arg in sys.argv[1:] if arg != "--stub"]
+    if "--stub" in sys.argv:
+        stub_kb()
+    n = int(args[0])
+    samples_file = Path(args[1]) if len(args) > 1 and "=" not in args[1] else Path("soak-samples.csv")
+    settings = parse_settings([arg for arg in args[1:] if "=" in arg])
+
+    samples = soak(n, samples_file, **settings)
+    sys.exit(0 if check_growth(samples, settings.get("duplication", DUPLICATION)) else 1)
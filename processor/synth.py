@@ -0,0 +1,126 @@
+# generates large synthetic corpora of XML records, for scale and soak testing, using the records in
+# tests/data as templates so that all three metadata profiles are represented
+#
+# each generated record gets a new identifier and its keyword sets are rebuilt from a corpus-wide pool of
+# template keywords: DUPLICATION is the chance a keyword is reused unchanged, otherwise it is made unique,
+# and THESAURUS_MIX is the chance a keyword set's thesaurus is swapped for another template's, or dropped
+
+import random
+import sys
+from copy import deepcopy
+from pathlib import Path
+
+from lxml import etree
+
+from utils import get_metadata_profile, NAMESPACES, NAMESPACES_19139, NAMESPACES_19115_1, Profile
+
+TEMPLATES_DIR = Path(__file__).parent.parent / "tests" / "data"
+
+KW_MIN = 1
+KW_MAX = 40
+DUPLICATION = 0.8
+THESAURUS_MIX = 0.2
+# the generator settings that can be given on the command line, as NAME=VALUE, and their types
+SETTINGS = {"seed": int, "kw_min": int, "kw_max": int, "duplication": float, "thesaurus_mix": float}
+
+
+def load_templates(templates_dir: Path = TEMPLATES_DIR) -> list:
+    return [etree.parse(str(f)) for f in sorted(templates_dir.glob("*.xml"))]
+
+
+def keyword_pools(templates: list) -> (dict, dict):
+    # keyword and thesaurus elements keyed by the namespace of their MD_Keywords, so 19139 and 19115-3 don't mix
+    keywords = {}
+    thesauri = {}
+    for et in templates:
+        for kw_set in et.xpath("//*[local-name()='MD_Keywords']"):
+            ns = etree.QName(kw_set).namespace
+            keywords.setdefault(ns, []).extend(kw_set.xpath("*[local-name()='keyword']"))
+            thesauri.setdefault(ns, []).extend(kw_set.xpath("*[local-name()='thesaurusName']"))
+    return keywords, thesauri
+
+
+def set_id(et, new_id: str):
+    if get_metadata_profile(et) == Profile.ISO19115:
+        ids = et.xpath(
+            "//mdb:metadataIdentifier/mcc:MD_Identifier/mcc:code/gco:CharacterString",
+            namespaces={**NAMESPACES, **NAMESPACES_19115_1},
+        )
+    else:
+        ids = et.xpath(
+            "//gmd:fileIdentifier/gco:CharacterString",
+            namespaces={**NAMESPACES, **NAMESPACES_19139},
+        )
+    for id_element in ids:
+        id_element.text = new_id
+
+
+def make_unique(keyword, token: str):
+    for anchor in keyword.xpath("*[local-name()='Anchor']"):
+        href = "{" + NAMESPACES["xlink"] + "}href"
+        if anchor.get(href):
+            anchor.set(href, anchor.get(href).rstrip("/") + "-" + token)
+    for text_element in keyword.xpath("*[local-name()='CharacterString' or local-name()='Anchor']"):
+        text_element.text = (text_element.text or "") + " " + token
+
+
+def generate_record(template, i: int, keywords: dict, thesauri: dict, rng: random.Random,
+                    kw_min: int = KW_MIN, kw_max: int = KW_MAX,
+                    duplication: float = DUPLICATION, thesaurus_mix: float = THESAURUS_MIX):
+    et = deepcopy(template)
+    set_id(et, f"synth-{i:08}")
+
+    for kw_set in et.xpath("//*[local-name()='MD_Keywords']"):
+        ns = etree.QName(kw_set).namespace
+
+        old_keywords = kw_set.xpath("*[local-name()='keyword']")
+        if len(old_keywords) == 0:
+            continue
+        # new keywords go where the old ones were, to keep the schema's element order
+        position = kw_set.index(old_keywords[0])
+        for kw in old_keywords:
+            kw_set.remove(kw)
+        for j in range(rng.randint(kw_min, kw_max)):
+            kw = deepcopy(rng.choice(keywords[ns]))
+            if rng.random() >= duplication:
+                make_unique(kw, f"s{i}k{j}")
+            kw_set.insert(position + j, kw)
+
+        if rng.random() < thesaurus_mix:
+            for thesaurus in kw_set.xpath("*[local-name()='thesaurusName']"):
+                if len(thesauri.get(ns, [])) > 0 and rng.random() < 0.5:
+                    thesaurus.getparent().replace(thesaurus, deepcopy(rng.choice(thesauri[ns])))
+                else:
+                    kw_set.remove(thesaurus)
+
+    return et
+
+
+def generate_records(n: int, seed: int = 0, templates_dir: Path = TEMPLATES_DIR, **kwargs):
+    # yields (name, ElementTree) pairs, cycling through the templates
+    rng = random.Random(seed)
+    templates = load_templates(templates_dir)
+    keywords, thesauri = keyword_pools(templates)
+    for i in range(n):
+        yield f"synth-{i:08}.xml", generate_record(templates[i % len(templates)], i, keywords, thesauri, rng, **kwargs)
+
+
+def parse_settings(args: list) -> dict:
+    settings = {}
+    for arg in args:
+        name, _, value = arg.partition("=")
+        if name not in SETTINGS or value == "":
+            raise ValueError(f"unknown setting {arg}, expected NAME=VALUE for NAME in {', '.join(SETTINGS)}")
+        settings[name] = SETTINGS[name](value)
+    return settings
+
+
+def write_corpus(n: int, out_dir: Path, seed: int = 0, **kwargs):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name, et in generate_records(n, seed, **kwargs):
+        et.write(str(out_dir / name), xml_declaration=True, encoding="UTF-8")
+
+
+if __name__ == "__main__":
+    # usage: python synth.py NUMBER_OF_RECORDS OUTPUT_DIR [NAME=VALUE...], e.g. duplication=1.0 kw_max=10
+    write_corpus(int(sys.argv[1]), Path(sys.argv[2]), **parse_settings(sys.argv[3:]))
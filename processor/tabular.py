@@ -0,0 +1,96 @@
+# writes keyword match results to a columnar file - Parquet if pyarrow is installed, otherwise CSV -
+# in batches, for match-rate analysis without re-parsing the N-Triples output
+#
+# both formats add to the results of earlier runs, e.g. retries, rather than replacing them. A CSV file is appended
+# to, and a ".parquet" results file is a dataset directory to which each writer adds a new numbered part file,
+# readable as one table with pyarrow.parquet.read_table()
+
+import csv
+from pathlib import Path
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+COLUMNS = ["record", "original", "value", "thesaurus", "theme", "tier"]
+BATCH_SIZE = 10_000
+
+
+class MatchResultsWriter:
+    def __init__(self, results_file: Path, batch_size: int = BATCH_SIZE):
+        self.results_file = Path(results_file)
+        self.batch_size = batch_size
+        self.rows = []
+        self.parquet_writer = None
+
+        self.parquet = self.results_file.suffix == ".parquet"
+        if self.parquet and pyarrow is None:
+            raise ImportError("pyarrow is required to write Parquet results, use a .csv results file instead")
+        if self.parquet and self.results_file.is_file():
+            raise ValueError(f"{self.results_file} is a file, Parquet results are written to a dataset directory")
+
+    def add(self, doc_iri: str, thesauri: {}):
+        for thesaurus, content in thesauri.items():
+            for kw in content["keywords"]:
+                self.rows.append((
+                    str(doc_iri),
+                    kw["original"],
+                    kw["value"],
+                    kw.get("thesaurus"),
+                    kw["theme"],
+                    kw.get("tier"),
+                ))
+
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.rows) == 0:
+            return
+
+        if self.parquet:
+            table = pyarrow.table({
+                c: pyarrow.array([row[i] for row in self.rows], type=pyarrow.string()) for i, c in enumerate(COLUMNS)
+            })
+            if self.parquet_writer is None:
+                self.results_file.mkdir(parents=True, exist_ok=True)
+                part = 0
+                while (self.results_file / f"part-{part:05d}.parquet").exists():
+                    part += 1
+                self.parquet_writer = pyarrow.parquet.ParquetWriter(
+                    self.results_file / f"part-{part:05d}.parquet", table.schema
+                )
+            self.parquet_writer.write_table(table)
+        else:
+            new_file = not self.results_file.is_file()
+            with open(self.results_file, "a", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(COLUMNS)
+                writer.writerows(self.rows)
+
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+            self.parquet_writer = None
+
+
+def read_match_results(results_file: Path):
+    # yields (original, thesaurus, value, tier) keyword cache entries from earlier runs' results, which, unlike
+    # their N-Triples output, record the tier that matched each keyword
+    results_file = Path(results_file)
+    if results_file.suffix == ".parquet":
+        if pyarrow is None:
+            raise ImportError("pyarrow is required to read Parquet results")
+        rows = pyarrow.parquet.read_table(results_file, columns=COLUMNS).to_pylist()
+    else:
+        rows = csv.DictReader(open(results_file, newline="", encoding="utf-8"))
+
+    for row in rows:
+        # CSV has no nulls, so a keyword without a thesaurus was written as ""
+        yield row["original"], row["thesaurus"] or None, row["value"], row["tier"] or None
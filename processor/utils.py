@@ -2,6 +2,15 @@ from enum import Enum
 from pathlib import Path
 from typing import Union, Optional
 
+import gzip
+import json
+import os
+import pickle
+import re
+import tarfile
+import threading
+import zlib
+
 import httpx
 from lxml import etree
 from rdflib import Namespace, URIRef
@@ -68,6 +77,19 @@ NAMESPACES_19115_1 = {
 EX = Namespace("http://example.com/")
 KW = Namespace("https://w3id.org/kw/")
 
+# identifies the loaded KB, so that cached SPARQL responses and local copies of the KB, such as KB_INDEX, made
+# from another KB are discarded. See get_kb_version()
+KB_VERSION = None
+# whether the KB has been asked for its version, so that a KB without one is only asked, and warned about, once
+KB_VERSION_READ = False
+# SPARQL responses, keyed by the SHA1 digest of the whitespace-normalised query, see query_cache_key()
+# values are zlib-compressed JSON of the result bindings (or ASK boolean)
+QUERY_CACHE = {}
+# held while QUERY_CACHE is written to or copied, so that it can be saved while other threads query
+QUERY_CACHE_LOCK = threading.Lock()
+# a single client keeps connections to the KB open between queries and can be shared by threads
+DB_CLIENT = httpx.Client(timeout=30)
+
 
 class Profile(Enum):
     SEADATANET = "SeaDataNet"
@@ -135,26 +157,130 @@ def make_record_iri(id: str) -> URIRef:
     return "http://example.com/record/" + id
 
 
-def send_query_to_db(query):
-    r = httpx.get(
-        "http://localhost:3030/ds",
-        headers={"Accept": "application/sparql-results+json"},
-        params={"query": query},
-        timeout=30
-    )
-    if r.status_code == 400:
-        print(r.text)
-        print(query)
+def get_kb_version() -> Optional[str]:
+    # the KB_VERSION environment variable if it's set, otherwise the KB's own stamp, which should be updated whenever
+    # the KB is reloaded, e.g. with
+    #   INSERT DATA { GRAPH sa:system-graph { sa:system-graph owl:versionInfo "2024-09-01" } }
+    # or None if there is neither, in which case nothing persisted from a KB can be trusted to be from this one
+    global KB_VERSION, KB_VERSION_READ
+    if KB_VERSION is None:
+        KB_VERSION = os.environ.get("KB_VERSION")
+    if KB_VERSION is None and not KB_VERSION_READ:
+        KB_VERSION_READ = True
+        try:
+            r = send_query_to_db("""
+                PREFIX owl: <http://www.w3.org/2002/07/owl#>
+                PREFIX sa: <https://w3id.org/semanticanalyser/>
+
+                SELECT ?version
+                WHERE {
+                  GRAPH sa:system-graph { sa:system-graph owl:versionInfo ?version . }
+                }
+                """, cache=False)
+        except QueryError as e:
+            print(f"KB_VERSION: could not read it from the KB, {e}")
+            r = []
+        if len(r) > 0:
+            KB_VERSION = r[0]["version"]["value"]
+            print(f"KB_VERSION: {KB_VERSION}")
+        else:
+            print(
+                "*" * 80 + "\n"
+                "KB_VERSION: WARNING the KB has no sa:system-graph owl:versionInfo stamp and the KB_VERSION environment\n"
+                "            variable isn't set, so cached SPARQL responses and KB_INDEX won't be loaded or saved\n" +
+                "*" * 80
+            )
+
+    return KB_VERSION
+
+
+SPARQL_STRING = re.compile(r'"(?:[^"\\\n\r]|\\.)*"|\'(?:[^\'\\\n\r]|\\.)*\'')
+
+
+def pickle_store(obj, file):
+    # written to a temporary file then renamed over the old one, so that readers, perhaps on other hosts, never see
+    # a half-written file
+    tmp_file = Path(f"{file}.{os.getpid()}.tmp")
+    with open(tmp_file, "wb") as f:
+        pickle.dump(obj, f)
+    os.replace(tmp_file, file)
+
+
+def query_cache_key(query: str) -> bytes:
+    # whitespace is collapsed only outside string literals, as inside them it's part of what is matched
+    parts = []
+    last = 0
+    for m in SPARQL_STRING.finditer(query):
+        parts.append(re.sub(r"\s+", " ", query[last:m.start()]))
+        parts.append(m.group())
+        last = m.end()
+    parts.append(re.sub(r"\s+", " ", query[last:]))
+    return sha1("".join(parts).strip().encode()).digest()
+
+
+def query_cache_prep(query_cache_file, kb_version: str = None):
+    kb_version = kb_version or get_kb_version()
+    QUERY_CACHE.clear()
+    if kb_version is None:
+        print("QUERY_CACHE: the KB version is unknown, not loading")
+    elif Path(query_cache_file).is_file():
+        stored = pickle.load(open(query_cache_file, "rb"))
+        if stored.get("kb_version") == kb_version:
+            QUERY_CACHE.update(stored["responses"])
+        else:
+            print(f"QUERY_CACHE: KB version changed from {stored.get('kb_version')} to {kb_version}, discarding")
+
+    print(f"QUERY_CACHE: {len(QUERY_CACHE)}")
+
+
+def query_cache_store(query_cache_file, kb_version: str = None):
+    kb_version = kb_version or get_kb_version()
+    if kb_version is None:
+        print("QUERY_CACHE: the KB version is unknown, not saving")
+        return
+    with QUERY_CACHE_LOCK:
+        responses = dict(QUERY_CACHE)
+    pickle_store({"kb_version": kb_version, "responses": responses}, query_cache_file)
+
+
+class QueryError(Exception):
+    def __init__(self, message, query):
+        super().__init__(message)
+        self.query = query
+
+
+def send_query_to_db(query, cache: bool = True):
+    key = query_cache_key(query)
+    cached = QUERY_CACHE.get(key) if cache else None
+    if cached is not None:
+        return json.loads(zlib.decompress(cached))
+
+    try:
+        r = DB_CLIENT.get(
+            "http://localhost:3030/ds",
+            headers={"Accept": "application/sparql-results+json"},
+            params={"query": query},
+        )
+    except httpx.HTTPError as e:
+        raise QueryError(f"{type(e).__name__}: {e}", query)
+
+    if r.status_code != 200:
+        raise QueryError(f"HTTP {r.status_code}: {str_tidy(r.text)}", query)
+
     try:
-        if r.json().get("boolean"):
-            return r.json()["boolean"]
+        j = r.json()
+        if "boolean" in j:
+            result = j["boolean"]
         else:
-            return r.json()["results"]["bindings"]
+            result = j["results"]["bindings"]
     except Exception as e:
-        print(e)
-        print(query)
-        exit()
-        return {}
+        raise QueryError(f"{type(e).__name__}: {e}", query)
+
+    if cache:
+        compressed = zlib.compress(json.dumps(result, separators=(",", ":")).encode())
+        with QUERY_CACHE_LOCK:
+            QUERY_CACHE[key] = compressed
+    return result
 
 
 def upload_file_to_db(ttl_file: Path, graph_iri: str):
@@ -168,6 +294,26 @@ def upload_file_to_db(ttl_file: Path, graph_iri: str):
     return r.status_code, r.text
 
 
+def read_nt_lines(nt_file: Path):
+    # yields the lines of an N-Triples file, which may be plain, gzipped or a gzipped tarball of .nt files
+    # a blank line is yielded between tarball members so that they stay separate record blocks
+    nt_file = Path(nt_file)
+    if nt_file.suffix == ".gz":
+        if tarfile.is_tarfile(nt_file):
+            with tarfile.open(nt_file, "r|gz") as tf:
+                for member in tf:
+                    if member.isfile():
+                        for line in tf.extractfile(member):
+                            yield line.decode("utf-8")
+                        yield "\n"
+        else:
+            with gzip.open(nt_file, "rt", encoding="utf-8") as f:
+                yield from f
+    else:
+        with open(nt_file, encoding="utf-8") as f:
+            yield from f
+
+
 def replace_all(text, dic):
     for i, j in dic.items():
         text = text.replace(i, j)
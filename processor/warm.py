@@ -0,0 +1,83 @@
+# reconstructs (original, thesaurus, value) keyword cache entries from existing *-keywords.nt(.gz) outputs
+# by streaming their triples, rather than loading them into an rdflib Graph, so that a new corpus can
+# start with a hot KW_CACHE
+#
+# entries are only reconstructed within a record's block of triples, as a concept's thesauri and originals are
+# only known to belong together there. merge.py's output has no record blocks, so it can't be warmed from
+
+import re
+from pathlib import Path
+
+from utils import read_nt_lines
+from merge import TRIPLE
+
+CITATION = "<https://schema.org/citation>"
+VALUE = "<https://schema.org/value>"
+REPLACEE = "<https://schema.org/replacee>"
+IN_DEFINED_TERM_SET = "<https://schema.org/inDefinedTermSet>"
+KEYWORDS = "<https://schema.org/keywords>"
+# no record's output is anywhere near this long, so a longer block is not a record's
+MAX_BLOCK_LINES = 100_000
+
+ESCAPE = re.compile(r"\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)")
+ESCAPES = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f", '"': '"', "'": "'", "\\": "\\"}
+
+
+def term_value(term: str):
+    # the string value of an N-Triples IRI or literal term, dropping any language tag or datatype
+    if term.startswith("<"):
+        return term[1:-1]
+    if term.startswith('"'):
+        literal = term[1:term.rindex('"')]
+        return ESCAPE.sub(lambda m: chr(int(m.group(1)[1:], 16)) if len(m.group(1)) > 1 else ESCAPES.get(m.group(1), m.group(1)), literal)
+    return term
+
+
+def block_cache_entries(triples):
+    values = {}
+    citations = {}
+    replacees = {}
+    thesauri = {}
+    keywords = set()
+    docs = set()
+    for s, p, o in triples:
+        if p == VALUE and s.startswith("_:"):
+            values[s] = term_value(o)
+        elif p == CITATION:
+            citations.setdefault(s, []).append(o)
+        elif p == REPLACEE and s.startswith("<"):
+            replacees.setdefault(s, []).append(term_value(o))
+        elif p == IN_DEFINED_TERM_SET:
+            thesauri.setdefault(s, []).append(term_value(o))
+        elif p == KEYWORDS:
+            docs.add(s)
+            if o.startswith("<"):
+                keywords.add(o)
+
+    if len(docs) > 1:
+        raise ValueError("a block of triples has the keywords of several records, warm from unmerged outputs")
+
+    for concept in keywords | citations.keys() | replacees.keys():
+        originals = [values[c] for c in citations.get(concept, []) if c in values] + replacees.get(concept, [])
+        if concept in keywords:
+            # an IRI keyword maps to itself whether or not text keywords were also matched to it
+            originals.append(term_value(concept))
+        for original in set(originals):
+            for thesaurus in thesauri.get(concept, [None]):
+                yield original, thesaurus, term_value(concept)
+
+
+def read_kw_cache_entries(nt_file: Path):
+    # blank lines separate the output of each record, so only one record's triples are held at a time
+    block = []
+    for line in read_nt_lines(nt_file):
+        m = TRIPLE.match(line)
+        if m is not None:
+            block.append(m.groups())
+            if len(block) > MAX_BLOCK_LINES:
+                raise ValueError(f"{nt_file} has no record blocks, e.g. it is merge.py output, warm from unmerged outputs")
+        elif line.strip() == "" and len(block) > 0:
+            yield from block_cache_entries(block)
+            block = []
+    if len(block) > 0:
+        yield from block_cache_entries(block)
@@ -0,0 +1,122 @@
+# a work queue of record paths, held in a SQLite file, that workers on several hosts claim batches from
+#
+# a claimed batch is leased to its worker until lease_expires, and the worker must keep renewing the lease
+# while it works. Batches whose lease has expired, e.g. because their worker died, can be claimed again
+#
+# the queue file may be on shared storage, but SQLite's locking relies on the filesystem's: NFS locking
+# must work, and WAL mode is not used as it needs shared memory between the hosts
+
+import sqlite3
+from pathlib import Path
+from time import time
+from typing import List, Optional
+
+BATCH_SIZE = 100
+LEASE_SECONDS = 300
+# batches that keep killing their workers are given up on, and marked failed, after this many claims
+MAX_ATTEMPTS = 3
+
+
+def queue_connect(queue_file: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(queue_file, timeout=60, isolation_level=None)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS items (
+            path TEXT PRIMARY KEY,
+            batch INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS items_batch ON items (batch);
+        CREATE INDEX IF NOT EXISTS items_status ON items (status, lease_expires);
+    """)
+    return conn
+
+
+def queue_populate(conn: sqlite3.Connection, records: List[Path], batch_size: int = BATCH_SIZE) -> int:
+    conn.execute("BEGIN IMMEDIATE")
+    first_batch = conn.execute("SELECT COALESCE(MAX(batch) + 1, 0) FROM items").fetchone()[0]
+    # only records not already queued are numbered into batches, so that re-populating from a grown folder fills
+    # whole batches with the new records
+    added = 0
+    for r in records:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO items (path, batch) VALUES (?, ?)", (str(r), first_batch + added // batch_size)
+        )
+        added += cur.rowcount
+    conn.execute("COMMIT")
+    return added
+
+
+def queue_fail_exhausted(conn: sqlite3.Connection, now: float):
+    # batches whose last allowed lease has expired would otherwise stay leased forever
+    conn.execute(
+        """
+        UPDATE items SET status = 'failed', lease_expires = NULL
+        WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?
+        """,
+        (now, MAX_ATTEMPTS)
+    )
+
+
+def queue_claim(conn: sqlite3.Connection, worker: str, lease_seconds: int = LEASE_SECONDS) -> (Optional[int], List[Path]):
+    now = time()
+    conn.execute("BEGIN IMMEDIATE")
+    queue_fail_exhausted(conn, now)
+    row = conn.execute(
+        """
+        SELECT batch FROM items
+        WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) AND attempts < ?
+        ORDER BY batch
+        LIMIT 1
+        """,
+        (now, MAX_ATTEMPTS)
+    ).fetchone()
+    if row is None:
+        conn.execute("COMMIT")
+        return None, []
+
+    batch = row[0]
+    conn.execute(
+        """
+        UPDATE items SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1
+        WHERE batch = ? AND (status = 'pending' OR (status = 'leased' AND lease_expires < ?))
+        """,
+        (worker, now + lease_seconds, batch, now)
+    )
+    paths = [Path(r[0]) for r in conn.execute(
+        "SELECT path FROM items WHERE batch = ? AND worker = ? AND status = 'leased' ORDER BY path",
+        (batch, worker)
+    )]
+    conn.execute("COMMIT")
+    return batch, paths
+
+
+def queue_renew(conn: sqlite3.Connection, worker: str, batch: int, lease_seconds: int = LEASE_SECONDS) -> bool:
+    # False if the lease has been lost, i.e. it expired and another worker claimed the batch
+    cur = conn.execute(
+        "UPDATE items SET lease_expires = ? WHERE batch = ? AND worker = ? AND status = 'leased'",
+        (time() + lease_seconds, batch, worker)
+    )
+    return cur.rowcount > 0
+
+
+def queue_complete(conn: sqlite3.Connection, worker: str, batch: int):
+    conn.execute(
+        "UPDATE items SET status = 'done', lease_expires = NULL WHERE batch = ? AND worker = ? AND status = 'leased'",
+        (batch, worker)
+    )
+
+
+def queue_status(conn: sqlite3.Connection) -> dict:
+    queue_fail_exhausted(conn, time())
+    status = {s: n for s, n in conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status")}
+    status["expired"] = conn.execute(
+        "SELECT COUNT(*) FROM items WHERE status = 'leased' AND lease_expires < ?", (time(),)
+    ).fetchone()[0]
+    return status
+
+
+def queue_failed(conn: sqlite3.Connection) -> List[Path]:
+    return [Path(r[0]) for r in conn.execute("SELECT path FROM items WHERE status = 'failed' ORDER BY path")]
@@ -0,0 +1,41 @@
+from pathlib import Path
+
+import pytest
+from lxml import etree
+
+import extract
+from extract import get_thes_and_kws
+
+GA_RECORD = Path(__file__).parent / "data" / "ga-a05f7892-bc27-7506-e044-00144fdd4fa6.xml"
+ANZSRC = "Australian and New Zealand Standard Research Classification (ANZSRC)"
+
+
+@pytest.fixture(autouse=True)
+def no_kb(monkeypatch):
+    # nothing is in the KB, so thesauri keep the IRIs and names the records give them
+    monkeypatch.setattr(extract, "send_query_to_db", lambda q, **kwargs: [])
+    monkeypatch.setattr(extract, "KB_INDEX", None)
+
+
+def test_iso19115_3_keyword_sets():
+    doc_iri, theses = get_thes_and_kws(GA_RECORD)
+
+    assert doc_iri == "http://example.com/record/a05f7892-bc27-7506-e044-00144fdd4fa6"
+    assert [kw["value"] for kw in theses["empty"]["keywords"]] == \
+        ["Topographic Map", "50K scale", "topography", "AU-QLD", "Published_External"]
+    [anzsrc] = [t for k, t in theses.items() if k != "empty"]
+    assert anzsrc == {"name": ANZSRC, "keywords": [{"value": "Topology", "theme": None}]}
+
+
+def test_iso19115_3_thesaurus_identifier():
+    xml = GA_RECORD.read_text()
+    title_end = xml.index("</cit:title>", xml.index(ANZSRC)) + len("</cit:title>")
+    xml = xml[:title_end] + \
+        '<cit:identifier><mcc:MD_Identifier><mcc:code>' \
+        '<gcx:Anchor xlink:href="https://linked.data.gov.au/def/anzsrc-for/2008">ANZSRC</gcx:Anchor>' \
+        '</mcc:code></mcc:MD_Identifier></cit:identifier>' + \
+        xml[title_end:]
+
+    _, theses = get_thes_and_kws(etree.ElementTree(etree.fromstring(xml.encode())))
+
+    assert theses["https://linked.data.gov.au/def/anzsrc-for/2008"]["name"] == ANZSRC
@@ -0,0 +1,70 @@
+import pytest
+
+from kb_index import index_key, write_kb_index, kb_index_open
+
+GRAPH = "https://example.com/vocab"
+CONCEPT = "https://example.com/vocab/c1"
+
+
+@pytest.fixture
+def index_file(tmp_path):
+    entries = {
+        index_key("pref", GRAPH, "sea"): {CONCEPT},
+        index_key("pref", GRAPH, "sea surface"): {CONCEPT + "0", CONCEPT + "1"},
+        index_key("pref_en", None, "sea"): {CONCEPT},
+        index_key("concept", None, CONCEPT): {GRAPH, ""},
+        index_key("concept", None, CONCEPT + "0"): {GRAPH},
+        index_key("concept", None, CONCEPT + "01"): {""},
+    }
+    write_kb_index(tmp_path / "KB_INDEX.bin", entries, kb_version="v1")
+    return tmp_path / "KB_INDEX.bin"
+
+
+@pytest.fixture
+def index(index_file):
+    index = kb_index_open(index_file, kb_version="v1")
+    yield index
+    index.close()
+
+
+def test_get(index):
+    assert index.get("pref", GRAPH, "sea") == [CONCEPT]
+    assert index.get("pref", GRAPH, "sea surface") == [CONCEPT + "0", CONCEPT + "1"]
+    assert index.get("pref_en", None, "sea") == [CONCEPT]
+
+
+def test_get_missing(index):
+    assert index.get("pref", GRAPH, "se") == []
+    assert index.get("pref", GRAPH, "sea surface temperature") == []
+    assert index.get("pref", None, "sea") == []
+    assert index.get("alt", GRAPH, "sea") == []
+    assert index.get("pref_en", None, "zzz") == []
+
+
+def test_graphs(index):
+    assert index.graphs(CONCEPT) == {GRAPH, None}
+    assert index.graphs(CONCEPT + "0") == {GRAPH}
+    assert index.graphs(CONCEPT + "01") == {None}
+
+
+def test_graphs_of_prefixes_and_missing_iris(index):
+    assert index.graphs("https://example.com/vocab/c") == set()
+    assert index.graphs(CONCEPT + "1") == set()
+    assert index.graphs(CONCEPT + "010") == set()
+    assert index.graphs("https://example.com/vocab/") == set()
+
+
+def test_version_mismatch(index_file):
+    assert kb_index_open(index_file, kb_version="v2") is None
+
+
+def test_missing_file(tmp_path):
+    assert kb_index_open(tmp_path / "KB_INDEX.bin", kb_version="v1") is None
+
+
+def test_empty(tmp_path):
+    write_kb_index(tmp_path / "KB_INDEX.bin", {}, kb_version="v1")
+    index = kb_index_open(tmp_path / "KB_INDEX.bin", kb_version="v1")
+    assert index.get("pref", GRAPH, "sea") == []
+    assert index.graphs(CONCEPT) == set()
+    index.close()
@@ -0,0 +1,22 @@
+import csv
+
+import utils
+from utils import QUERY_CACHE
+from extract import KW_CACHE, KW_INDEX, THES_CACHE
+from soak import soak, stub_kb
+
+
+def test_soak_runs_records_through_the_pipeline(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, "DB_CLIENT", utils.DB_CLIENT)
+    stub_kb()
+
+    samples = soak(20, tmp_path / "samples.csv", interval=5, duplication=1.0)
+
+    assert [s["records"] for s in samples] == [5, 10, 15, 20]
+    assert samples[-1]["kw_cache"] == len(KW_CACHE) > 0
+    assert samples[-1]["query_cache"] == len(QUERY_CACHE) > 0
+    with open(tmp_path / "samples.csv") as f:
+        assert [int(row["records"]) for row in csv.DictReader(f)] == [5, 10, 15, 20]
+
+    for cache in [KW_CACHE, KW_INDEX, THES_CACHE, QUERY_CACHE]:
+        cache.clear()
@@ -0,0 +1,54 @@
+import pytest
+
+import utils
+from utils import get_kb_version, query_cache_prep, query_cache_store, QUERY_CACHE
+
+
+@pytest.fixture(autouse=True)
+def kb_version_unread(monkeypatch):
+    monkeypatch.setattr(utils, "KB_VERSION", None)
+    monkeypatch.setattr(utils, "KB_VERSION_READ", False)
+    monkeypatch.delenv("KB_VERSION", raising=False)
+    yield
+    QUERY_CACHE.clear()
+
+
+def stamp(monkeypatch, rows):
+    queries = []
+    monkeypatch.setattr(utils, "send_query_to_db", lambda q, **kwargs: queries.append(q) or rows)
+    return queries
+
+
+def test_kb_version_from_environment(monkeypatch):
+    queries = stamp(monkeypatch, [{"version": {"value": "kb"}}])
+    monkeypatch.setenv("KB_VERSION", "env")
+    assert get_kb_version() == "env"
+    assert queries == []
+
+
+def test_kb_version_from_kb(monkeypatch):
+    queries = stamp(monkeypatch, [{"version": {"value": "kb"}}])
+    assert get_kb_version() == "kb"
+    assert get_kb_version() == "kb"
+    assert len(queries) == 1
+
+
+def test_unstamped_kb_is_asked_once(monkeypatch):
+    queries = stamp(monkeypatch, [])
+    assert get_kb_version() is None
+    assert get_kb_version() is None
+    assert len(queries) == 1
+
+
+def test_query_cache_needs_kb_version(monkeypatch, tmp_path):
+    stamp(monkeypatch, [])
+    QUERY_CACHE["q"] = b"r"
+    query_cache_store(tmp_path / "QUERY_CACHE.p", kb_version="v1")
+
+    query_cache_prep(tmp_path / "QUERY_CACHE.p")
+    assert QUERY_CACHE == {}
+    query_cache_store(tmp_path / "QUERY_CACHE.p.new")
+    assert not (tmp_path / "QUERY_CACHE.p.new").exists()
+
+    query_cache_prep(tmp_path / "QUERY_CACHE.p", kb_version="v1")
+    assert QUERY_CACHE == {"q": b"r"}
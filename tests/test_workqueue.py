@@ -0,0 +1,97 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from workqueue import queue_connect, queue_populate, queue_claim, queue_renew, queue_complete, queue_status, \
+    queue_failed, MAX_ATTEMPTS
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = queue_connect(tmp_path / "queue.db")
+    queue_populate(conn, [Path(f"r{i}.xml") for i in range(5)], batch_size=2)
+    yield conn
+    conn.close()
+
+
+def test_claim_takes_batches_in_order(conn):
+    assert queue_claim(conn, "w1") == (0, [Path("r0.xml"), Path("r1.xml")])
+    assert queue_claim(conn, "w2") == (1, [Path("r2.xml"), Path("r3.xml")])
+    assert queue_claim(conn, "w1") == (2, [Path("r4.xml")])
+    assert queue_claim(conn, "w2") == (None, [])
+
+
+def test_complete(conn):
+    batch, _ = queue_claim(conn, "w1")
+    queue_complete(conn, "w1", batch)
+    assert queue_status(conn) == {"done": 2, "pending": 3, "expired": 0}
+
+
+def test_expired_lease_is_reclaimed(conn):
+    batch, paths = queue_claim(conn, "w1", lease_seconds=-1)
+    assert queue_status(conn)["expired"] == 2
+
+    assert queue_claim(conn, "w2") == (batch, paths)
+    assert queue_status(conn)["expired"] == 0
+
+
+def test_live_lease_is_not_reclaimed(conn):
+    batch, _ = queue_claim(conn, "w1")
+    assert queue_claim(conn, "w2")[0] != batch
+
+
+def test_renew_after_loss(conn):
+    batch, _ = queue_claim(conn, "w1", lease_seconds=-1)
+    queue_claim(conn, "w2")
+
+    assert not queue_renew(conn, "w1", batch)
+    assert queue_renew(conn, "w2", batch)
+
+    # the lost worker can't complete the batch either
+    queue_complete(conn, "w1", batch)
+    assert queue_status(conn).get("done", 0) == 0
+
+
+def test_exhausted_attempts_fail_the_batch(conn):
+    for i in range(MAX_ATTEMPTS):
+        assert queue_claim(conn, f"w{i}", lease_seconds=-1)[0] == 0
+
+    # the batch isn't claimed again, and is reported as failed rather than left leased
+    assert queue_claim(conn, "w9")[0] == 1
+    status = queue_status(conn)
+    assert status["failed"] == 2
+    assert status["expired"] == 0
+    assert queue_failed(conn) == [Path("r0.xml"), Path("r1.xml")]
+
+
+def test_repopulate_batches_only_new_records(conn):
+    assert queue_populate(conn, [Path(f"r{i}.xml") for i in range(7)], batch_size=2) == 2
+    batches = dict(conn.execute("SELECT path, batch FROM items"))
+    assert batches["r5.xml"] == batches["r6.xml"] == 3
+
+
+def test_merge_deduplicates_shards(tmp_path, monkeypatch):
+    import utils
+    import distributed
+
+    monkeypatch.setattr(utils, "KB_VERSION", "test")
+    queue_connect(tmp_path / "queue.db").close()
+    for worker in ["a", "b"]:
+        # both workers processed record r1, as its batch was re-claimed
+        (tmp_path / f"keywords.{worker}.nt").write_text("<http://example.com/s> <http://example.com/p> \"o\" .\n")
+        (tmp_path / f"quarantine.{worker}.jsonl").write_text(json.dumps({"record": "r2.xml", "errors": []}) + "\n")
+        (tmp_path / f"matches.{worker}.csv").write_text(
+            "record,original,value,thesaurus,theme,tier\n"
+            "r1,\"a, b\",http://example.com/a,,theme,iri\n"
+            + ("r3,c,c,,,unmatched\n" if worker == "b" else "")
+        )
+
+    distributed.merge(tmp_path / "queue.db")
+
+    assert (tmp_path / "matches.csv").read_text().splitlines() == [
+        "record,original,value,thesaurus,theme,tier",
+        "r1,\"a, b\",http://example.com/a,,theme,iri",
+        "r3,c,c,,,unmatched",
+    ]
+    assert len((tmp_path / "quarantine.jsonl").read_text().splitlines()) == 1